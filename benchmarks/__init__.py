@@ -0,0 +1,3 @@
+"""
+Synthetic results files and benchmarks for the report.
+"""
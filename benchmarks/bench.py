@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+
+"""
+Time each stage of demographic_report.py and hlp_redcap_import.py on
+synthetic results files of several sizes and compare against a stored
+baseline, to catch performance regressions.
+
+Run from the repository root with `python -m benchmarks.bench`.
+"""
+
+import argparse
+from contextlib import redirect_stdout
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+from typing import Dict, List
+
+import pandas as pd
+
+from mturkrsrb.config import load_config
+from mturkrsrb.enrollment import enrollment_tables
+from mturkrsrb.output import write_report
+from mturkrsrb.pipeline import build_report
+from mturkrsrb.profiling import Profiler
+from mturkrsrb.redcap import export_redcap, read_report, report_protocol
+from mturkrsrb.years import compile_datebreaks
+
+from .synthetic import generate_corpus
+
+benchmark_dir = os.path.dirname(os.path.abspath(__file__))
+
+size_suffixes = {'k': 1000, 'M': 1000000}
+
+
+def parse_size(size: str) -> int:
+    """Turn '10k' or '1M' into a number of rows."""
+    if size[-1:] in size_suffixes:
+        return int(float(size[:-1]) * size_suffixes[size[-1]])
+    return int(size)
+
+
+def corpus_config(rows: int, args: argparse.Namespace) -> str:
+    """Return the config of the synthetic corpus for a size, generating it if it doesn't exist yet."""
+    directory = os.path.join(args.data_dir, f'{rows}-f{args.files}-d{args.dup_rate}-s{args.seed}')
+    config = os.path.join(directory, 'config.yml')
+    if not os.path.exists(config):
+        print(f'Generating {rows} rows of synthetic results in {directory}')
+        generate_corpus(directory, rows, args.files, args.dup_rate, seed=args.seed)
+    return config
+
+
+def run_once(config: str, args: argparse.Namespace) -> List[dict]:
+    """Make the report and its REDCap import file for `config` once and return the stage records."""
+    profiler = Profiler(True, trace_memory=args.memory)
+    with profiler.stage('config') as stage:
+        expdata = load_config(config)
+        yearbreaks = compile_datebreaks(expdata['datebreaks'])
+        stage['rows_out'] = len(expdata['resultsfiles'])
+
+    results = build_report(expdata, yearbreaks, profiler, jobs=args.jobs, engine=args.engine,
+                           stream=args.stream)
+
+    with profiler.stage('enrollment', rows_in=len(results)) as stage:
+        tables = enrollment_tables(results, yearbreaks[2])
+        stage['rows_out'] = len(tables)
+
+    with profiler.stage('write', rows_in=len(results)) as stage:
+        report_file = write_report(results, expdata['protocol'], tables=tables)
+        stage['rows_out'] = len(results)
+
+    # The stages of hlp_redcap_import.py
+    with profiler.stage('redcap_read') as stage:
+        report = read_report(report_file)
+        stage['rows_out'] = len(report)
+    with profiler.stage('redcap_export', rows_in=len(report)) as stage:
+        redcap_file, new, updated = export_redcap(report, report_protocol(report_file))
+        stage['rows_out'] = new
+    return profiler.stages
+
+
+def run_size(rows: int, args: argparse.Namespace) -> Dict[str, dict]:
+    """Benchmark one corpus size, keeping the fastest of `args.repeat` runs of each stage."""
+    config = os.path.abspath(corpus_config(rows, args))
+    timings = {}
+    cwd = os.getcwd()
+    for _ in range(args.repeat):
+        with tempfile.TemporaryDirectory() as outdir:
+            os.chdir(outdir)
+            try:
+                if args.verbose:
+                    stages = run_once(config, args)
+                else:
+                    with redirect_stdout(io.StringIO()):
+                        stages = run_once(config, args)
+            finally:
+                os.chdir(cwd)
+        for stage in stages:
+            stage.pop('files', None)
+            best = timings.get(stage['stage'])
+            if best is None or stage['seconds'] < best['seconds']:
+                timings[stage['stage']] = stage
+    return timings
+
+
+def compare(results: Dict[str, Dict[str, dict]], baseline: dict, tolerance: float, min_seconds: float) -> List[str]:
+    """
+    Print each stage's time next to the baseline and return the stages that
+    got more than `tolerance` (a fraction) slower. Differences below
+    `min_seconds` are never counted, as they are mostly noise.
+    """
+    regressions = []
+    for rows, timings in results.items():
+        print(f'{rows} rows:')
+        base_timings = baseline.get('results', {}).get(rows, {})
+        for name, stage in timings.items():
+            line = f'  {name:<14}{stage["seconds"]:9.3f}s'
+            base = base_timings.get(name)
+            if base is not None:
+                change = stage['seconds'] / base['seconds'] - 1 if base['seconds'] else 0
+                line += f'  (baseline {base["seconds"]:.3f}s, {change:+.0%})'
+                if change > tolerance and stage['seconds'] - base['seconds'] > min_seconds:
+                    line += '  REGRESSION'
+                    regressions.append(f'{rows} rows {name}')
+                if base.get('rows_out') != stage.get('rows_out'):
+                    line += f'  [rows out {stage.get("rows_out")} vs {base.get("rows_out")} in baseline]'
+            print(line)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark the report stages on synthetic results files')
+    parser.add_argument('--sizes', default='10k,100k,1M',
+                        help='Comma separated numbers of assignments to benchmark (default: 10k,100k,1M)')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Run each size this many times and keep the fastest time per stage (default: 1)')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes to read results files with (default: 1)')
+    parser.add_argument('--engine', choices=('c', 'python', 'pyarrow'), default='c',
+                        help='pandas CSV parser engine (default: c)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Benchmark --stream instead of reading every assignment into memory')
+    parser.add_argument('--memory', action='store_true',
+                        help='Also measure peak memory per stage (slows every stage down)')
+    parser.add_argument('--files', type=int, default=6,
+                        help='Number of results files per corpus (default: 6)')
+    parser.add_argument('--dup-rate', type=float, default=0.5,
+                        help='Fraction of assignments by workers who did another one (default: 0.5)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed for the synthetic results (default: 0)')
+    parser.add_argument('--data-dir', default=os.path.join(benchmark_dir, 'data'),
+                        help='Directory to keep the generated results files in (default: benchmarks/data)')
+    parser.add_argument('--baseline', default=os.path.join(benchmark_dir, 'baseline.json'),
+                        help='Baseline timings file (default: benchmarks/baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='Store the timings of this run as the new baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='Fraction a stage may get slower than the baseline before it counts as a '
+                             'regression (default: 0.25)')
+    parser.add_argument('--min-seconds', type=float, default=0.05,
+                        help='Slowdowns of fewer seconds than this never count as regressions (default: 0.05)')
+    parser.add_argument('-v', '--verbose', action='store_true',
+                        help="Show the report's own output")
+    args = parser.parse_args()
+
+    settings = {'jobs': args.jobs, 'engine': args.engine, 'stream': args.stream, 'memory': args.memory,
+                'files': args.files, 'dup_rate': args.dup_rate, 'seed': args.seed}
+    results = {}
+    for size in args.sizes.split(','):
+        rows = parse_size(size)
+        results[str(rows)] = run_size(rows, args)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as bfile:
+            baseline = json.load(bfile)
+        if baseline.get('settings') != settings:
+            print(f'Baseline was made with different settings: {baseline.get("settings")}')
+    else:
+        print(f'No baseline in {args.baseline}; run with --save-baseline to store one')
+
+    regressions = compare(results, baseline, args.tolerance, args.min_seconds)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as bfile:
+            json.dump({'settings': settings, 'python': platform.python_version(), 'pandas': pd.__version__,
+                       'machine': platform.node(), 'results': results}, bfile, indent=2)
+        print(f'Saved baseline to {args.baseline}')
+    elif regressions:
+        print(f'{len(regressions)} stages got slower: ' + ', '.join(regressions))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
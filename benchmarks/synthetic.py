@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+
+"""
+Write synthetic MTurk results files, and a config listing them, to benchmark
+the report without real participant data.
+
+The files cover every layout the report handles: tab and comma delimited,
+API (lowercase) and web UI column names, a single 'Answer.rsrb.race' column
+or one boolean column per race, old style "['Male']" and plain answers,
+files without demographics, and API, web UI and odd timestamp formats.
+"""
+
+import argparse
+import os
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# Cycled through when writing files. Each one is a results file layout.
+layouts = (
+    dict(delimiter='tab', names='api', race='single', answers='plain', demographics=True),
+    dict(delimiter='comma', names='webui', race='single', answers='bracketed', demographics=True),
+    dict(delimiter='tab', names='api', race='columns', answers='plain', demographics=True),
+    dict(delimiter='tab', names='webui', race='single', answers='plain', demographics=False),
+    dict(delimiter='comma', names='api', race='single', answers='bracketed', demographics=True),
+    dict(delimiter='tab', names='webui', race='columns', answers='bracketed', demographics=True),
+)
+
+# API column name -> web UI column name
+webui_names = {'hitid': 'HITId',
+               'hittypeid': 'HITTypeId',
+               'title': 'Title',
+               'reward': 'Reward',
+               'creationtime': 'CreationTime',
+               'annotation': 'RequesterAnnotation',
+               'assignmentduration': 'AssignmentDurationInSeconds',
+               'assignmentid': 'AssignmentId',
+               'workerid': 'WorkerId',
+               'assignmentstatus': 'AssignmentStatus',
+               'assignmentaccepttime': 'AcceptTime',
+               'assignmentsubmittime': 'SubmitTime'}
+
+race_keys = ('amerind', 'asian', 'black', 'other', 'pacif', 'white')
+
+# Roughly the mix of answers seen on MTurk; the last entry of each is "no answer"
+sexes = ('Female', 'Male', '')
+sex_weights = (0.49, 0.49, 0.02)
+ethnicities = ('NonHisp', 'Hisp', '')
+ethnicity_weights = (0.88, 0.09, 0.03)
+bracketed_ethnicities = {'NonHisp': "['Not Hispanic or Latino']", 'Hisp': "['Hispanic or Latino']", '': "['N/A']"}
+race_weights = (0.01, 0.07, 0.08, 0.01, 0.005, 0.725)
+multiracial_rate = 0.05
+unknown_race_rate = 0.05
+
+browsers = ('Chrome', 'Firefox', 'Safari', 'Edge')
+
+# Submit times are spread over this period, a bit wider than the datebreaks
+period = (pd.Timestamp('2016-05-01', tz='UTC'), pd.Timestamp('2019-08-31', tz='UTC'))
+datebreaks = {'2016-2017': {'start': '2016-06-01', 'end': '2017-05-31'},
+              '2017-2018': {'start': '2017-06-01', 'end': '2018-05-31'},
+              '2018-2019': {'start': '2018-06-01', 'end': '2019-05-31'}}
+
+
+def make_workers(count: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Make `count` workers with fixed demographics."""
+    races = rng.choice(len(race_keys), size=count, p=np.array(race_weights) / sum(race_weights))
+    flags = np.zeros((count, len(race_keys)), dtype=bool)
+    flags[np.arange(count), races] = True
+    # Multiracial workers pick a second race
+    multi = rng.random(count) < multiracial_rate
+    flags[multi, rng.integers(0, len(race_keys), size=multi.sum())] = True
+    ids = rng.integers(16**12, 16**13, size=count)
+    codes = np.array([f'{k};' for k in race_keys])
+    return pd.DataFrame({
+        'workerid': [f'A{i:013X}' for i in ids],
+        'sex': rng.choice(sexes, size=count, p=sex_weights),
+        'ethnicity': rng.choice(ethnicities, size=count, p=ethnicity_weights),
+        'race': ['|'.join(codes[f]) for f in flags],
+        'unknown_race': rng.random(count) < unknown_race_rate,
+        'age': rng.integers(18, 75, size=count),
+        **{f'race_{k}': flags[:, i] for i, k in enumerate(race_keys)},
+    })
+
+
+def assign_workers(rows: int, dup_rate: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    Pick the worker of each of `rows` assignments, so that a fraction
+    `dup_rate` of the assignments are by a worker who did another one.
+    """
+    count = max(1, round(rows * (1 - dup_rate)))
+    order = rng.permutation(rows)
+    worker = np.empty(rows, dtype=np.int64)
+    worker[order[:count]] = np.arange(count)
+    worker[order[count:]] = rng.integers(0, count, size=rows - count)
+    return worker
+
+
+def timestamps(times: pd.Series, names: str, rng: np.random.Generator) -> np.ndarray:
+    """
+    Format times the way results files with `names` columns do.
+
+    Web UI files use 'Wed Jan 03 10:22:11 PST 2018', API files ISO 8601 in a
+    couple of flavors. A few are blank or in a format only dateutil reads.
+    """
+    if names == 'webui':
+        pacific = times.dt.tz_convert('America/Los_Angeles')
+        formatted = pacific.dt.strftime('%a %b %d %H:%M:%S %Z %Y').values
+    else:
+        formatted = times.dt.strftime('%Y-%m-%dT%H:%M:%SZ').values
+        spaced = rng.random(len(times)) < 0.3
+        formatted[spaced] = times[spaced].dt.strftime('%Y-%m-%d %H:%M:%S+00:00').values
+    odd = rng.random(len(times)) < 0.005
+    formatted[odd] = times[odd].dt.strftime('%d %B %Y %H:%M UTC').values
+    formatted[rng.random(len(times)) < 0.002] = ''
+    return formatted
+
+
+def results_frame(workers: pd.DataFrame, fileno: int, layout: dict, mismatch_rate: float,
+                  rng: np.random.Generator) -> pd.DataFrame:
+    """Make the assignments of one results file by `workers` (one row each)."""
+    rows = len(workers)
+    submitted = period[0] + pd.to_timedelta(rng.random(rows) * (period[1] - period[0]).total_seconds(), unit='s')
+    submitted = pd.Series(submitted).dt.floor('s')
+    accepted = submitted - pd.to_timedelta(rng.integers(60, 3600, size=rows), unit='s')
+    hit = rng.integers(0, max(1, rows // 100), size=rows)
+    rdf = pd.DataFrame({
+        'hitid': [f'3H{fileno:04d}{h:08d}' for h in hit],
+        'hittypeid': f'3T{fileno:04d}',
+        'title': f'Listening experiment {fileno}',
+        'reward': '$1.00',
+        'creationtime': timestamps(accepted - pd.Timedelta(days=1), layout['names'], rng),
+        'annotation': '',
+        'assignmentduration': 3600,
+        'assignmentid': [f'3A{fileno:04d}{i:010d}' for i in range(rows)],
+        'workerid': workers['workerid'].values,
+        'assignmentstatus': 'Approved',
+        'assignmentaccepttime': timestamps(accepted, layout['names'], rng),
+        'assignmentsubmittime': timestamps(submitted, layout['names'], rng),
+    })
+    if layout['names'] == 'webui':
+        rdf = rdf.rename(columns=webui_names)
+
+    if fileno % 2:
+        rdf['Answer.experiment'] = rng.choice(['exposure', 'test'], size=rows)
+    if layout['race'] == 'columns':
+        rdf['Answer.userAgent'] = rng.choice(browsers, size=rows)
+    else:
+        rdf['Answer.browser'] = rng.choice(browsers, size=rows)
+
+    if layout['demographics']:
+        sex = workers['sex'].values.copy()
+        ethnicity = workers['ethnicity'].values.copy()
+        # Some workers answer differently from one HIT to the next
+        flip = rng.random(rows) < mismatch_rate
+        sex[flip] = rng.choice(sexes, size=flip.sum(), p=sex_weights)
+        flip = rng.random(rows) < mismatch_rate
+        ethnicity[flip] = rng.choice(ethnicities, size=flip.sum(), p=ethnicity_weights)
+        if layout['answers'] == 'bracketed':
+            sex = np.where(sex == '', sex, np.char.add(np.char.add("['", sex.astype(str)), "']"))
+            ethnicity = pd.Series(ethnicity).map(bracketed_ethnicities).values
+        rdf['Answer.rsrb.sex'] = sex
+        rdf['Answer.rsrb.ethnicity'] = ethnicity
+        age = workers['age'].astype(str).values.copy()
+        age[rng.random(rows) < 0.1] = ''
+        rdf['Answer.rsrb.age'] = age
+
+        flags = workers[[f'race_{k}' for k in race_keys]].values
+        unknown = workers['unknown_race'].values
+        if layout['race'] == 'columns':
+            for i, key in enumerate(race_keys):
+                rdf[f'Answer.rsrb.race.{key}'] = np.where(flags[:, i] & ~unknown, 'true', 'false')
+            rdf['Answer.rsrb.race.unknown'] = np.where(unknown, 'true', 'false')
+        else:
+            rdf['Answer.rsrb.race'] = np.where(unknown, '', workers['race'].values)
+
+    # Trial data is by far the biggest column of real results files
+    rdf['Answer.trialdata'] = rng.choice(['x' * n for n in range(200, 2000, 150)], size=rows)
+    rdf['Answer.comments'] = ''
+    return rdf
+
+
+def generate_corpus(directory: str, rows: int, files: int = 6, dup_rate: float = 0.5,
+                    mismatch_rate: float = 0.05, seed: Optional[int] = 0) -> str:
+    """
+    Write `files` results files with `rows` assignments between them to
+    `directory`, along with a config listing them, and return the config's
+    file name.
+
+    A fraction `dup_rate` of the assignments are by workers who did another
+    HIT too, possibly in another file, and `mismatch_rate` of all answers
+    differ from the worker's usual one.
+    """
+    rng = np.random.default_rng(seed)
+    os.makedirs(directory, exist_ok=True)
+    worker_of = assign_workers(rows, dup_rate, rng)
+    workers = make_workers(worker_of.max() + 1, rng)
+
+    lines = ['resultsfiles:']
+    for fileno, file_rows in enumerate(np.array_split(worker_of, files)):
+        layout = layouts[fileno % len(layouts)]
+        rdf = results_frame(workers.iloc[file_rows].reset_index(drop=True), fileno, layout, mismatch_rate, rng)
+        comma = layout['delimiter'] == 'comma'
+        filename = os.path.abspath(os.path.join(directory, f'results{fileno}.{"csv" if comma else "tsv"}'))
+        rdf.to_csv(filename, sep=',' if comma else '\t', index=False)
+        lines.append(f'  - file: {filename}')
+        if comma:
+            lines.append('    delimiter: comma')
+        lines.append('    experimenter: Synthetic Experimenter')
+        lines.append(f'    name: Synthetic Experiment {fileno}')
+    lines.append('protocol: synthetic')
+    lines.append('datebreaks:')
+    for year, drange in datebreaks.items():
+        lines.extend([f'  {year}:', f'    start: {drange["start"]}', f'    end: {drange["end"]}'])
+
+    config = os.path.join(directory, 'config.yml')
+    with open(config, 'w') as cfile:
+        cfile.write('\n'.join(lines) + '\n')
+    return config
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Write synthetic MTurk results files and a config listing them')
+    parser.add_argument('directory',
+                        help='Directory to write the results files and config.yml to')
+    parser.add_argument('-n', '--rows', type=int, default=10000,
+                        help='Total number of assignments (default: 10000)')
+    parser.add_argument('-f', '--files', type=int, default=6,
+                        help='Number of results files (default: 6, one of each layout)')
+    parser.add_argument('-d', '--dup-rate', type=float, default=0.5,
+                        help='Fraction of assignments by workers who did another one (default: 0.5)')
+    parser.add_argument('-m', '--mismatch-rate', type=float, default=0.05,
+                        help='Fraction of demographic answers that differ from the worker\'s usual one '
+                             '(default: 0.05)')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed (default: 0)')
+    args = parser.parse_args()
+
+    config = generate_corpus(args.directory, args.rows, args.files, args.dup_rate, args.mismatch_rate, args.seed)
+    print(f'Wrote {args.rows} assignments in {args.files} results files; config is {config}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,16 @@
+"""
+Read in Mechanical Turk results files to calculate demographic information
+for various funding and regulatory agencies.
+
+The report is built in stages, each in its own module: `config` loads the
+YAML file, `scan` checks the results files from their first lines, `ingest`
+reads them, `normalize` reduces the answers to the report's values, `years`
+assigns report years, `dedup` removes duplicate workers, `enrollment`
+counts the report rows for the enrollment tables and `output` writes the
+report (in one of the `formats`). `pipeline` runs them in order (or through
+`stream` or `registry`), timed by `profiling`.
+
+`validate` checks configs without reading any results file, `redcap` turns
+a report into REDCap import records and `cli` holds the command line
+scripts.
+"""
@@ -0,0 +1,254 @@
+"""
+Command line interfaces of demographic_report.py and hlp_redcap_import.py.
+"""
+
+import argparse
+from datetime import date
+import importlib.util
+import os
+import sys
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+from .formats import output_extensions
+from .profiling import Profiler
+
+if TYPE_CHECKING:
+    import numpy as np
+    import pandas as pd
+
+# Everything that needs pandas is imported once there is data to process, so
+# --help, --validate and argument errors come back right away
+
+
+def write_outputs(results: 'pd.DataFrame', protocol: str, yearbreaks: Tuple['np.ndarray', 'np.ndarray', 'np.ndarray'],
+                  args: argparse.Namespace, profiler: Profiler):
+    """Write the report of a protocol, its enrollment tables and REDCap import file as `args` ask."""
+    from .enrollment import enrollment_tables
+    from .output import write_enrollment, write_report
+    from .redcap import export_redcap
+
+    print(f'There are {len(results.workerid.unique())} unique workers out of {len(results)} rows')
+
+    tables = None
+    if args.enrollment != 'none':
+        with profiler.stage('enrollment', rows_in=len(results)) as stage:
+            tables = enrollment_tables(results, yearbreaks[2])
+            stage['rows_out'] = len(tables)
+
+    with profiler.stage('write', rows_in=len(results)) as stage:
+        workers = not args.no_worker_sheet
+        try:
+            if workers and args.output_format != 'xlsx':
+                write_report(results, protocol, args.output_format)
+            # Enrollment table sheets go in an Excel report of their own if need be
+            xlsx_workers = workers and args.output_format == 'xlsx'
+            if xlsx_workers or args.enrollment == 'xlsx':
+                write_report(results, protocol, 'xlsx', tables if args.enrollment == 'xlsx' else None,
+                             workers=xlsx_workers)
+        except ValueError as e:
+            print(f'Cannot write the report. {e}')
+            sys.exit(1)
+        if args.enrollment in ('csv', 'json'):
+            print(f'Wrote enrollment tables to {write_enrollment(tables, protocol, args.enrollment)}')
+
+        if args.redcap:
+            try:
+                redcap_file, new, updated = export_redcap(results, protocol, ledger=args.redcap_ledger,
+                                                          updates=args.redcap_updates)
+            except ValueError as e:
+                print(f'Cannot make REDCap import file. {e}')
+            else:
+                print(f'Wrote {new} new and {updated} updated REDCap records to {redcap_file}')
+        stage['rows_out'] = len(results)
+
+
+def report_main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='Load one or more MTurk results files and extract the NIH '
+                    'mandated demographic info')
+    parser.add_argument('-r', '--resultsfilelist', required=True, nargs='+', metavar='RESULTSFILELIST',
+                        help='(required) YAML file with list of results files to use; with several, each '
+                             'results file is read once and a report is written for each protocol')
+    parser.add_argument('-s', '--rawsubjects',
+                        action='store_true',
+                        help='Dump a raw file of all assignments without removing duplicate workers')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of processes to use for reading results files (default: 1)')
+    parser.add_argument('--engine', choices=('c', 'python', 'pyarrow'), default='c',
+                        help='pandas CSV parser engine to read results files with (default: c)')
+    parser.add_argument('--cache-dir', default=os.path.join(os.path.expanduser('~'), '.cache', 'mturkrsrb'),
+                        help='Directory to cache parsed results files in (default: ~/.cache/mturkrsrb)')
+    parser.add_argument('--cache-size', type=int, default=2048,
+                        help='Size in MB above which cache entries no longer used by this config are removed '
+                             '(default: 2048)')
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Don't read or write the results file cache")
+    parser.add_argument('--rebuild-cache', action='store_true',
+                        help='Parse every results file again and replace its cache entry')
+    parser.add_argument('--stream', action='store_true',
+                        help='Read results files in chunks, keeping only per-worker data in memory '
+                             '(for very large files; does not use the cache)')
+    parser.add_argument('--chunksize', type=int, default=100000,
+                        help='Rows per chunk with --stream (default: 100000)')
+    parser.add_argument('--memory-report', action='store_true',
+                        help='Print the memory used by each column, and what the categorical ones would take as text')
+    parser.add_argument('--registry', nargs='?', const='', metavar='DATABASE',
+                        help='Keep all assignments in a SQLite registry and only process new or changed results '
+                             'files (default database: <protocol>_registry.db)')
+    parser.add_argument('--year',
+                        help='Only report workers from this report year (one of the datebreaks)')
+    parser.add_argument('--redcap', action='store_true',
+                        help='Also write a REDCap import file, like running hlp_redcap_import.py on the report')
+    parser.add_argument('--redcap-ledger', metavar='LEDGER',
+                        help='With --redcap, only export workers not in this ledger of earlier exports and add '
+                             'the new ones to it')
+    parser.add_argument('--redcap-updates', action='store_true',
+                        help='With --redcap-ledger, also export known workers whose demographics changed')
+    parser.add_argument('--output-format', choices=tuple(output_extensions), default='xlsx',
+                        help='Format of the report and of the --rawsubjects file (default: xlsx, with a CSV '
+                             'rawsubjects file)')
+    parser.add_argument('--enrollment', choices=('xlsx', 'csv', 'json', 'none'),
+                        help='Where to write the enrollment tables (Race by Ethnicity and Sex, overall and per '
+                             'year): sheets in an Excel report, a CSV or JSON file, or nowhere (default: xlsx '
+                             'for Excel reports, otherwise csv)')
+    parser.add_argument('--no-worker-sheet', action='store_true',
+                        help='Leave the per-worker Demographic Data out of the report; with --enrollment '
+                             'csv or json no report is written at all')
+    parser.add_argument('--scan', action='store_true',
+                        help='Only check the results files from their headers and first lines: layout, '
+                             'demographics, delimiter, field counts and estimated rows')
+    parser.add_argument('--validate', action='store_true',
+                        help="Only check the config: required keys, that the results files exist and can be "
+                             "read, delimiters, and that the datebreaks are dates in ranges that don't overlap")
+    parser.add_argument('--profile', nargs='?', const='', metavar='FILE',
+                        help='Write the wall time, rows in and out and peak memory of each stage (and of each '
+                             'results file) to a JSON file (default: <protocol>_profile-<date>.json)')
+    # parser.add_argument('-p', '--protocol', required=True,
+    #                     help='Specifiy the IRB protocol name')
+    args = parser.parse_args(argv)
+    if args.stream and args.rawsubjects and args.jobs > 1:
+        parser.error('--rawsubjects with --stream writes assignments as they are read and needs --jobs 1')
+    if args.stream and args.registry is not None:
+        parser.error('--registry needs every assignment and cannot be used with --stream')
+    if args.registry is not None and args.rawsubjects:
+        parser.error('--rawsubjects cannot be used with --registry, which only loads new results files')
+    if args.stream and args.engine == 'pyarrow':
+        parser.error('the pyarrow engine cannot read in chunks; use --engine c with --stream')
+    if importlib.util.find_spec('pyarrow') is None:
+        # Found before any results file is read, not when the output is written
+        if args.engine == 'pyarrow':
+            parser.error('--engine pyarrow needs pyarrow installed (pip install pyarrow)')
+        if args.output_format in ('parquet', 'feather'):
+            parser.error(f'--output-format {args.output_format} needs pyarrow installed (pip install pyarrow)')
+    if len(args.resultsfilelist) > 1:
+        if args.stream or args.registry is not None:
+            parser.error('--stream and --registry work on one config at a time')
+        if args.redcap_ledger:
+            parser.error('--redcap-ledger keeps the exports of a single protocol; use one config with it')
+    if args.enrollment is None:
+        args.enrollment = 'xlsx' if args.output_format == 'xlsx' else 'csv'
+
+    if args.validate:
+        from .validate import validate_configs
+        sys.exit(0 if validate_configs(args.resultsfilelist) else 1)
+
+    from .config import load_config
+    from .pipeline import build_report, build_reports, source_key
+    from .scan import ResultsFileError, report_scan, scan_errors, scan_index_file, scan_resultsfiles
+    from .years import compile_datebreaks
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    profiler = Profiler(args.profile is not None)
+    with profiler.stage('config') as stage:
+        expdatas = []
+        yearbreaks = []
+        for resultsfilelist in args.resultsfilelist:
+            try:
+                expdata = load_config(resultsfilelist)
+            except ValueError as e:
+                print(e)
+                sys.exit(1)
+
+            try:
+                yearbreaks.append(compile_datebreaks(expdata['datebreaks']))
+            except ValueError as e:
+                print(f'Bad datebreaks: {e}')
+                sys.exit(1)
+            expdatas.append(expdata)
+        protocols = [expdata['protocol'] for expdata in expdatas]
+        if len(set(protocols)) < len(protocols):
+            print('Every config needs a protocol of its own, or their reports would overwrite each other')
+            sys.exit(1)
+        stage['rows_out'] = sum(len(expdata['resultsfiles']) for expdata in expdatas)
+
+    if args.scan:
+        # Each results file once, however many configs list it
+        resfiles = {}
+        for expdata in expdatas:
+            for r in expdata['resultsfiles']:
+                resfiles.setdefault(source_key(r), r)
+        entries = scan_resultsfiles(list(resfiles.values()), scan_index_file(cache_dir))
+        report_scan(entries)
+        sys.exit(1 if scan_errors(entries) else 0)
+
+    raw_format = 'csv' if args.output_format == 'xlsx' else args.output_format
+    try:
+        if len(expdatas) > 1:
+            reports = build_reports(expdatas, yearbreaks, profiler, jobs=args.jobs, engine=args.engine,
+                                    cache_dir=cache_dir, rebuild_cache=args.rebuild_cache,
+                                    cache_size=args.cache_size, year=args.year, rawsubjects=args.rawsubjects,
+                                    raw_format=raw_format, memory_report=args.memory_report)
+        else:
+            protocol = protocols[0]
+            reports = [build_report(expdatas[0], yearbreaks[0], profiler, jobs=args.jobs, engine=args.engine,
+                                    cache_dir=cache_dir, rebuild_cache=args.rebuild_cache,
+                                    cache_size=args.cache_size, stream=args.stream, chunksize=args.chunksize,
+                                    registry=None if args.registry is None else
+                                    args.registry or f'{protocol}_registry.db',
+                                    year=args.year, rawsubjects=args.rawsubjects, raw_format=raw_format,
+                                    memory_report=args.memory_report)]
+    except ResultsFileError as e:
+        print(e)
+        sys.exit(1)
+
+    for protocol, protocol_yearbreaks, results in zip(protocols, yearbreaks, reports):
+        if len(protocols) > 1:
+            print(f'Protocol {protocol}:')
+        write_outputs(results, protocol, protocol_yearbreaks, args, profiler)
+
+    if args.profile is not None:
+        profile_name = args.profile or f'{"+".join(protocols)}_profile-{date.today().isoformat()}.json'
+        mode = 'registry' if args.registry is not None else 'stream' if args.stream else 'memory'
+        profiler.write(profile_name, config=args.resultsfilelist if len(protocols) > 1 else args.resultsfilelist[0],
+                       protocol=protocols if len(protocols) > 1 else protocols[0], mode=mode,
+                       jobs=args.jobs, engine=args.engine)
+        print(f'Wrote profile to {profile_name}')
+
+
+def redcap_main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        description='Convert demographic report into REDCap ready CSV file')
+    parser.add_argument('-f', '--file', required=True,
+                        help='(required) demographic report file (XLSX, CSV, feather, parquet or SQLite)')
+    parser.add_argument('-i', '--startindex', type=int, default=0,
+                        help='Integer index to start numbering record IDs with (default: 0, or after the '
+                             'highest record ID in --previous/--ledger)')
+    parser.add_argument('-p', '--previous', action='append', default=[],
+                        help='Earlier REDCap export; only workers not in it are exported (can be repeated)')
+    parser.add_argument('-l', '--ledger',
+                        help='CSV file of every record exported so far; only workers not in it are exported '
+                             'and it is updated with the new records')
+    parser.add_argument('-u', '--updates', action='store_true',
+                        help='With --previous/--ledger, also export known workers whose demographics changed')
+    args = parser.parse_args(argv)
+
+    from .redcap import export_redcap, read_report, report_protocol
+
+    try:
+        outfile_name, new, updated = export_redcap(read_report(args.file), report_protocol(args.file),
+                                                   args.startindex, args.previous, args.ledger, args.updates)
+    except ValueError as e:
+        print(e)
+        sys.exit(1)
+
+    print(f'Wrote {new} new and {updated} updated records to {outfile_name}')
@@ -0,0 +1,27 @@
+"""
+Load the YAML file listing the results files of a protocol.
+"""
+
+from ruamel.yaml import CLoader as Loader
+from ruamel.yaml import load
+
+required_keys = ('resultsfiles', 'protocol', 'datebreaks')
+
+
+def load_config(filename: str) -> dict:
+    """
+    Read a config (HIT) file.
+
+    Raises a ValueError naming every required key that is missing.
+    """
+    with open(filename, 'r') as rfile:
+        expdata = load(rfile, Loader=Loader)
+
+    if not isinstance(expdata, dict):
+        raise ValueError(f'{filename} is not a YAML mapping with {", ".join(required_keys)} keys; '
+                         f'aborting HIT load')
+    missing = [k for k in required_keys if k not in expdata]
+    if missing:
+        raise ValueError('\n'.join([f'{k} is a required key in HIT file!' for k in missing] +
+                                   ['At least one required key missing; aborting HIT load']))
+    return expdata
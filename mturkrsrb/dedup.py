@@ -0,0 +1,95 @@
+"""
+Remove duplicate workers from the normalized assignments.
+"""
+
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from .normalize import categorize, ethnicity_labels, race_labels, sex_labels
+from .years import year_dtype
+
+
+# The only columns that end up in the report; 'Year' is left out when
+# deciding whether two rows are duplicates
+core_cols = ('workerid', 'Sex', 'Race', 'Ethnicity', 'Year')
+
+dedup_cols = ['workerid', 'Sex', 'Race', 'Ethnicity']
+
+
+def compact_results(results: pd.DataFrame, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> pd.DataFrame:
+    """
+    Store the low-cardinality text columns as categoricals, in place, for
+    assignments that don't have them as categoricals already (e.g. from the
+    registry) and to put their categories in the order dedup needs.
+
+    'workerid' gets its categories in sorted order, so sorting, grouping and
+    duplicate removal all work on integer codes but still come out in the same
+    order as on the strings. 'Year' is ordered the same way so the lowest year
+    of a worker can be taken.
+    """
+    results['workerid'] = categorize(results['workerid'])
+    for col, labels in (('Sex', sex_labels), ('Race', race_labels), ('Ethnicity', ethnicity_labels)):
+        results[col] = categorize(results[col], labels)
+    results['Year'] = results['Year'].astype(year_dtype(yearbreaks))
+    for col in ('Experiment', 'Experimenter', 'Browser'):
+        if col in results:
+            results[col] = categorize(results[col])
+    return results
+
+
+def report_memory_usage(results: pd.DataFrame):
+    """Print the memory used by each column, and what the categorical ones would take as text."""
+    usage = results.memory_usage(deep=True, index=False)
+    as_text = usage.copy()
+    for col in results.columns:
+        if isinstance(results[col].dtype, pd.CategoricalDtype):
+            as_text[col] = results[col].astype(results[col].cat.categories.dtype).memory_usage(deep=True, index=False)
+    print(f'{"Column":<30}{"As text (KiB)":>15}{"Stored (KiB)":>15}')
+    for col in results.columns:
+        print(f'{col:<30}{as_text[col] / 1024:>15,.1f}{usage[col] / 1024:>15,.1f}')
+    print(f'{"Total":<30}{as_text.sum() / 1024:>15,.1f}{usage.sum() / 1024:>15,.1f}')
+
+
+def reconcile_workers(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Make the rows of workers who show up more than once agree with each other.
+
+    Every row of a duplicated worker gets that worker's lowest 'Year'. For
+    'Sex', 'Race' and 'Ethnicity', if the worker only ever gave one non-NA
+    value, all of their rows are set to it. Done for all workers in a single
+    groupby instead of scanning the frame once per worker.
+    """
+    results = results.copy()
+    dupes = results.duplicated('workerid', keep=False)  # default is to not mark 1st instance
+    grouped = results[dupes].groupby('workerid', sort=False, observed=True)
+
+    # For year, take lowest
+    results.loc[dupes, 'Year'] = grouped['Year'].transform('min')
+
+    # For sex, race, and ethnicity: if only one non-NA value set all to it
+    for col in ('Sex', 'Race', 'Ethnicity'):
+        single = grouped[col].transform('nunique') == 1
+        results.loc[single[single].index, col] = grouped[col].transform('first')[single]
+
+    return results
+
+
+def remove_mismatched_duplicates(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Try to drop more duplicated workers where values ostensibly mismatch.
+
+    Expects the output of the first duplicate removal pass, restricted to
+    `core_cols`.
+    """
+    results = results.copy()
+    # We're going to put the 'Unknown or Not Reported' back at the end but it's
+    # easier to drop na values
+    for col in ('Sex', 'Race', 'Ethnicity'):
+        results[col] = results[col].mask(results[col].isin(['Unknown', 'Unknown or Not Reported']))
+    results = reconcile_workers(results)
+    results.drop_duplicates(dedup_cols, inplace=True)
+    for col in ('Sex', 'Race', 'Ethnicity'):
+        results[col] = results[col].fillna('Unknown or Not Reported')
+    return results
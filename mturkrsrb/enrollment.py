@@ -0,0 +1,82 @@
+"""
+Count the report rows the way the NIH inclusion enrollment report and the
+RSRB want them: Race by Ethnicity and Sex, overall and per report year.
+"""
+
+from typing import Dict, Sequence
+
+import numpy as np
+import pandas as pd
+
+from .normalize import race_labels, sex_labels
+
+# The NIH enrollment table lists non-Hispanic first
+enrollment_ethnicities = ('NonHisp', 'Hisp', 'Unknown or Not Reported')
+
+# Key of the table over all report rows
+overall = 'All'
+
+
+def add_totals(table: pd.DataFrame) -> pd.DataFrame:
+    """Add a 'Total' column and row to an enrollment table."""
+    table = table.copy()
+    table[('Total', '')] = table.sum(axis=1)
+    table.loc['Total'] = table.sum()
+    return table
+
+
+def report_uncounted(results: pd.DataFrame, codes: Dict[str, np.ndarray]):
+    """Print a warning about the rows left out of the enrollment tables and their values."""
+    values = []
+    excluded = np.zeros(len(results), dtype=bool)
+    for col, col_codes in codes.items():
+        unknown = col_codes < 0
+        excluded |= unknown
+        for value, count in results.loc[unknown, col].astype(object).value_counts(dropna=False).items():
+            values.append(f'{col} {value!r} ({count})')
+    print(f'Warning: {excluded.sum()} report rows are not in the enrollment tables because their '
+          f'race, ethnicity or sex is not an enrollment category: {", ".join(values)}')
+
+
+def enrollment_tables(results: pd.DataFrame, years: Sequence) -> Dict[str, pd.DataFrame]:
+    """
+    Count report rows by Race (rows) and Ethnicity and Sex (columns).
+
+    Returns a table over all rows, under `overall`, followed by one per
+    report year in `years`, in that order. Every category is listed even if
+    nobody is in it, like on the NIH form. Rows that fell outside of all
+    report years are only counted in the overall table. Rows whose Race,
+    Ethnicity or Sex isn't one of the categories aren't counted anywhere;
+    a warning says how many there are and which values they have.
+    """
+    years = [str(y) for y in years]
+    year_labels = results['Year'].astype(str)
+    year = pd.Categorical(year_labels, categories=years + sorted(set(year_labels.unique()) - set(years)))
+    # Position of each value in its categories, -1 for anything else
+    label_codes = {col: pd.Index(labels).get_indexer(results[col].astype(object))
+                   for col, labels in (('Race', race_labels), ('Ethnicity', enrollment_ethnicities),
+                                       ('Sex', sex_labels))}
+
+    # Count every (year, race, ethnicity, sex) combination at once from the
+    # category codes; the tables are slices of the counts
+    codes = [year.codes.astype(np.int64)] + [c.astype(np.int64) for c in label_codes.values()]
+    shape = (len(year.categories), len(race_labels), len(enrollment_ethnicities), len(sex_labels))
+    known = np.logical_and.reduce([c >= 0 for c in codes])
+    if not known.all():
+        report_uncounted(results, label_codes)
+    cell = np.ravel_multi_index([c[known] for c in codes], shape)
+    counts = np.bincount(cell, minlength=np.prod(shape)).reshape(shape[0], shape[1], -1)
+
+    columns = pd.MultiIndex.from_product([enrollment_ethnicities, sex_labels], names=['Ethnicity', 'Sex'])
+    index = pd.Index(race_labels, name='Race')
+    tables = {overall: add_totals(pd.DataFrame(counts.sum(axis=0), index=index, columns=columns))}
+    for i, y in enumerate(years):
+        tables[y] = add_totals(pd.DataFrame(counts[i], index=index, columns=columns))
+    return tables
+
+
+def flatten_columns(table: pd.DataFrame) -> pd.DataFrame:
+    """Join the Ethnicity and Sex column labels, e.g. 'NonHisp Female', for flat files."""
+    table = table.copy()
+    table.columns = [' '.join(filter(None, col)) for col in table.columns]
+    return table
@@ -0,0 +1,7 @@
+"""
+File formats the report can be written in. Kept apart from `output` so the
+command line can offer them without importing pandas.
+"""
+
+# --output-format -> file extension
+output_extensions = {'xlsx': 'xlsx', 'csv': 'csv', 'parquet': 'parquet', 'feather': 'feather', 'sqlite': 'db'}
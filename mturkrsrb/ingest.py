@@ -0,0 +1,362 @@
+"""
+Read MTurk results files, optionally through a cache of parsed files.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import csv
+from functools import partial
+import hashlib
+import json
+import os
+from typing import Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .normalize import categorical_columns, categorize, set_categories, sort_labels
+from .profiling import Profiler
+
+
+CSI = '\x1B['
+
+reset = CSI+'m'
+
+# Column of the normalized assignments -> the results file columns it is read
+# from. MTurk's API and web UI name the same column differently, and various
+# people over time have used different names for the same answers; a new
+# variant only has to be added here. When a file has more than one of them,
+# the first one in this order with a value wins, except for `joined_columns`.
+# Results file columns not listed anywhere are never read.
+column_aliases = {
+    'hitid': ('hitid', 'HITId', 'HitId'),
+    # Some web UI downloaded files are missing 'HITTypeId' or 'hittypeid'
+    'hittypeid': ('hittypeid', 'HITTypeId'),
+    'title': ('title', 'Title', 'HitTitle'),
+    'description': ('description', 'Description'),
+    'keywords': ('keywords', 'Keywords'),
+    'reward': ('reward', 'Reward'),
+    'creationtime': ('creationtime', 'CreationTime'),
+    'assignments': ('assignments', 'MaxAssignments'),
+    'numavailable': ('numavailable', 'NumberofAssignmentsAvailable'),
+    'numpending': ('numpending', 'NumberofAssignmentsPending'),
+    'numcomplete': ('numcomplete', 'NumberofAssignmentsCompleted'),
+    'hitstatus': ('hitstatus', 'HITStatus'),
+    'reviewstatus': ('reviewstatus', 'HITReviewStatus'),
+    'annotation': ('annotation', 'RequesterAnnotation'),
+    'assignmentduration': ('assignmentduration', 'AssignmentDurationInSeconds'),
+    'autoapprovaltime': ('autoapprovaltime', 'AutoApprovalTime'),
+    'autoapprovedelay': ('autoapprovedelay', 'AutoApprovalDelayInSeconds'),
+    'hitlifetime': ('hitlifetime', 'LifetimeInSeconds'),
+    'viewhit': ('viewhit',),
+    'assignmentid': ('assignmentid', 'AssignmentId'),
+    'workerid': ('workerid', 'WorkerId'),
+    'assignmentstatus': ('assignmentstatus', 'AssignmentStatus'),
+    'assignmentaccepttime': ('assignmentaccepttime', 'AcceptTime'),
+    'assignmentsubmittime': ('assignmentsubmittime', 'SubmitTime'),
+    'assignmentapprovaltime': ('assignmentapprovaltime', 'ApprovalTime'),
+    'assignmentrejecttime': ('assignmentrejecttime', 'RejectionTime'),
+    'deadline': ('deadline',),
+    'feedback': ('feedback',),
+    'reject': ('reject',),
+    'Experiment': ('Experiment', 'Answer.experiment', 'Answer.Experiment'),
+    'Experimenter': ('Experimenter',),
+    'ExperimentList': ('Answer.list', 'Answer.List'),
+    'Browser': ('Answer.browser', 'Answer.browserid', 'Answer.Browser', 'Answer.userAgent'),
+    'Answer.rsrb.raceother': ('Answer.rsrb.raceother',),
+    'Ethnicity': ('Answer.rsrb.ethnicity',),
+    'Sex': ('Answer.rsrb.sex',),
+    'Age': ('Answer.rsrb.age',),
+    # Ilker has a column for each race, others just have "Answer.rsrb.race"
+    'Answer.rsrb.race.amerind': ('Answer.rsrb.race.amerind',),
+    'Answer.rsrb.race.asian': ('Answer.rsrb.race.asian',),
+    'Answer.rsrb.race.black': ('Answer.rsrb.race.black',),
+    'Answer.rsrb.race.other': ('Answer.rsrb.race.other',),
+    'Answer.rsrb.race.pacif': ('Answer.rsrb.race.pacif',),
+    'Answer.rsrb.race.unknown': ('Answer.rsrb.race.unknown',),
+    'Answer.rsrb.race.white': ('Answer.rsrb.race.white',),
+    'Answer.rsrb.race': ('Answer.rsrb.race',),
+}
+
+# Columns that keep the values of all their aliases, joined with this
+# separator, instead of just the first
+joined_columns = {'Browser': ','}
+
+# Columns filled in from this key of the config entry when a results file
+# has none of their aliases
+config_defaults = {'Experiment': 'name', 'Experimenter': 'experimenter'}
+
+# Free text and ID columns that should never go through type inference. Numeric
+# and boolean columns (e.g. the per-race 'Answer.rsrb.race.*' flags) are left
+# for the reader to infer.
+text_fields = {
+    'hitid', 'hittypeid', 'title', 'description', 'keywords', 'reward', 'creationtime',
+    'hitstatus', 'reviewstatus', 'annotation', 'autoapprovaltime', 'assignmentid', 'workerid',
+    'assignmentstatus', 'assignmentaccepttime', 'assignmentsubmittime', 'assignmentapprovaltime',
+    'assignmentrejecttime', 'deadline', 'feedback', 'Experiment', 'Experimenter', 'ExperimentList',
+    'Browser', 'Answer.rsrb.raceother', 'Ethnicity', 'Sex', 'Age', 'Answer.rsrb.race',
+}
+
+# Compiled from the tables above once, at import
+alias_of = {alias: column for column, aliases in column_aliases.items() for alias in aliases}
+columns_of_interest = set(alias_of)
+text_columns = {alias for column in text_fields for alias in column_aliases[column]}
+
+# Bump whenever load_resultsfile's output changes so stale cache entries are
+# never used
+cache_schema_version = 3
+
+
+def resultsfile_delimiter(r: dict) -> str:
+    """Return the delimiter for a results file entry in the config."""
+    delim = '\t'
+    if 'delimiter' in r:
+        if r['delimiter'] == 'comma':
+            delim = ','
+    return delim
+
+
+def read_header(filename: str, delim: str) -> List[str]:
+    """Read just the column names from the first line of a results file."""
+    with open(filename, 'r', newline='') as resfile:
+        return next(csv.reader(resfile, delimiter=delim), [])
+
+
+def read_options(r: dict, engine: str = 'c') -> dict:
+    """
+    Build the `pd.read_csv` arguments for a results file.
+
+    The header is read first (unless the entry already has it from
+    `scan.planned_resultsfiles`) so only the columns of interest get parsed;
+    everything else (trial data, feedback, etc.) is skipped by the CSV reader.
+    """
+    delim = resultsfile_delimiter(r)
+    header = r['header'] if 'header' in r else read_header(r['file'], delim)
+    usecols = [c for c in header if c in columns_of_interest]
+    dtypes = {c: str for c in usecols if c in text_columns}
+    # low_memory is only understood by the C engine
+    read_opts = {'low_memory': False} if engine == 'c' else {}
+    return dict(delimiter=delim, usecols=usecols, dtype=dtypes, engine=engine, **read_opts)
+
+
+def coalesce_columns(rdf: pd.DataFrame, aliases: List[str], sep: Optional[str] = None) -> pd.Series:
+    """
+    Combine the `aliases` columns of a frame into one, a whole column at a
+    time: the first value that isn't missing, or with `sep` all of them
+    joined by it.
+    """
+    values = rdf[aliases[0]]
+    for alias in aliases[1:]:
+        if sep is None:
+            values = values.fillna(rdf[alias])
+        else:
+            values = (values + sep + rdf[alias]).fillna(values).fillna(rdf[alias])
+    return values
+
+
+def normalize_columns(rdf: pd.DataFrame, r: dict) -> pd.DataFrame:
+    """
+    Rename columns to their names in `column_aliases`, combining the ones
+    that go by several names, and fill in `config_defaults` from the config
+    entry (if it has them) when the file itself doesn't provide them.
+
+    Columns stay in the order they first appear in the file. The
+    `categorical_columns` are converted to categoricals right away, so the
+    file's assignments take little memory from here on.
+    """
+    found = {}
+    for col in rdf.columns:
+        found.setdefault(alias_of.get(col, col), []).append(col)
+
+    # This is useful if you need to figure out which files are problematic
+    # but if you don't comment it out, you can end up with duplicates
+    # results_selected.loc[:, 'filename'] = r['file']
+
+    results_selected = {}
+    for column, aliases in found.items():
+        if len(aliases) > 1:
+            aliases.sort(key=column_aliases[column].index)
+        results_selected[column] = coalesce_columns(rdf, aliases, joined_columns.get(column))
+    results_selected = pd.DataFrame(results_selected, index=rdf.index)
+
+    for column, key in config_defaults.items():
+        if column not in results_selected and key in r:
+            results_selected[column] = r[key]
+
+    for column in categorical_columns:
+        if column in results_selected:
+            results_selected[column] = categorize(results_selected[column])
+    return results_selected
+
+
+def concat_results(frames: List[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Concatenate frames of assignments, keeping their categorical columns
+    categorical.
+
+    pandas only keeps a categorical if it has the same categories in every
+    frame that has the column, so those frames first get the union of all
+    their categories, in the order they first appear. A text column of the
+    same name in another frame is converted too.
+    """
+    dtypes = {}
+    for column in dict.fromkeys(c for frame in frames for c in frame.columns):
+        values = [frame[column] for frame in frames if column in frame]
+        found = [v.dtype for v in values if isinstance(v.dtype, pd.CategoricalDtype)]
+        if found:
+            categories = [v.cat.categories if isinstance(v.dtype, pd.CategoricalDtype) else
+                          sort_labels(pd.Index(v.dropna().unique())) for v in values]
+            categories = categories[0].append(categories[1:]).unique()
+            dtypes[column] = pd.CategoricalDtype(categories, ordered=found[0].ordered)
+
+    aligned = []
+    for frame in frames:
+        frame = frame.copy(deep=False)
+        for column, dtype in dtypes.items():
+            if column in frame:
+                frame[column] = set_categories(frame[column], dtype)
+        aligned.append(frame)
+    return pd.concat(aligned, ignore_index=True)
+
+
+def fill_config_defaults(rdf: pd.DataFrame, r: dict) -> pd.DataFrame:
+    """
+    Fill in `config_defaults` from a config entry, for assignments read
+    without them, unless the results file (going by its scanned header in
+    r['header']) provides the column itself.
+    """
+    provided = {alias_of.get(c, c) for c in r['header']}
+    defaults = {column: r[key] for column, key in config_defaults.items() if column not in provided and key in r}
+    return rdf.assign(**defaults) if defaults else rdf
+
+
+def load_resultsfile(r: dict, engine: str = 'c') -> pd.DataFrame:
+    """
+    Read a single results file and reduce it to the columns of interest.
+
+    Kept free of side effects so it can be run in a worker process.
+    """
+    read_opts = read_options(r, engine)
+    rdf: pd.DataFrame = pd.read_csv(r['file'], **read_opts)
+    if engine == 'pyarrow':
+        # pyarrow reads empty string fields as '' instead of missing
+        rdf = rdf.replace({c: {'': np.nan} for c in read_opts['dtype']})
+    return normalize_columns(rdf, r)
+
+
+def report_demographics(filename: str, columns: Iterable[str]):
+    """
+    Print whether a results file has demographic information in it, given
+    its columns as read or normalized.
+    """
+    # Some really old ones have no demographic data
+    # Color info from http://stackoverflow.com/a/21786287/3846301
+    if 'Ethnicity' not in {alias_of.get(c, c) for c in columns}:
+        print(CSI + '31;40m' + '✗' + CSI + '0m' + f'\t{os.path.basename(filename)} has no demographic information')
+    else:
+        print(CSI + '32;40m' + '✓' + CSI + '0m' + f'\t{os.path.basename(filename)} has demographic information')
+
+
+def cache_path(r: dict, engine: str, cache_dir: str) -> str:
+    """
+    Return where the parsed frame for a results file is cached.
+
+    The name is a hash of everything the parsed frame depends on: the file's
+    path, size and modification time, how it is read, the config defaults
+    that get filled in, and `cache_schema_version`.
+    """
+    stat = os.stat(r['file'])
+    key = json.dumps([os.path.abspath(r['file']), stat.st_size, stat.st_mtime_ns,
+                      resultsfile_delimiter(r), r.get('name'), r.get('experimenter'),
+                      engine, cache_schema_version], default=str)
+    return os.path.join(cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.feather')
+
+
+def load_cached_resultsfile(r: dict, engine: str = 'c', cache_dir: Optional[str] = None,
+                            rebuild: bool = False) -> Tuple[pd.DataFrame, bool]:
+    """
+    Load a results file through the on-disk cache.
+
+    Returns the frame `load_resultsfile` would, and whether it came from the
+    cache. Files that aren't cached yet (or all files if `rebuild` is set) are
+    parsed and written to the cache for next time. With no `cache_dir` this
+    is just `load_resultsfile`.
+    """
+    if cache_dir is None:
+        return load_resultsfile(r, engine), False
+
+    cached = cache_path(r, engine, cache_dir)
+    if not rebuild and os.path.exists(cached):
+        try:
+            rdf = pd.read_feather(cached)
+            # Feather gives back missing strings as None, the CSV reader as NaN
+            return rdf.fillna(np.nan), True
+        except (OSError, ValueError) as e:
+            print(f'Ignoring unreadable cache entry for {r["file"]}: {e}')
+
+    rdf = load_resultsfile(r, engine)
+    # Write to a temporary name first so a crash can't leave a partial entry
+    partial_path = f'{cached}.{os.getpid()}.tmp'
+    try:
+        rdf.to_feather(partial_path)
+        os.replace(partial_path, cached)
+    except (OSError, TypeError, ValueError) as e:
+        print(f'Could not cache {r["file"]}: {e}')
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+    return rdf, False
+
+
+def evict_cache(cache_dir: str, keep: Set[str], max_bytes: int):
+    """
+    Trim the cache down to `max_bytes`.
+
+    Only entries not in `keep` (i.e. not used by the current config) are
+    removed, least recently used first.
+    """
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file() and entry.name.endswith('.feather'):
+            stat = entry.stat()
+            entries.append((stat.st_atime, stat.st_size, entry.path))
+    total = sum(e[1] for e in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        if path not in keep:
+            os.remove(path)
+            total -= size
+
+
+def read_resultsfiles(resfiles: List[dict], jobs: int = 1, engine: str = 'c',
+                      cache_dir: Optional[str] = None, rebuild_cache: bool = False,
+                      profiler: Optional[Profiler] = None) -> List[pd.DataFrame]:
+    """
+    Load every results file in `resfiles` and return a frame per file.
+
+    With `jobs` > 1 files are read in a pool of worker processes. Frames come
+    back in config order either way, so the result is identical to a serial
+    run. If a `cache_dir` is given, unchanged files are loaded from the cache
+    instead of being parsed again. Each file is recorded in the current stage
+    of `profiler`.
+    """
+    profiler = profiler or Profiler()
+    loader = partial(load_cached_resultsfile, engine=engine, cache_dir=cache_dir,
+                     rebuild=rebuild_cache)
+    frames = []
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for r, ((rdf, from_cache), stats) in zip(resfiles, pool.map(profiler.task(loader), resfiles)):
+                print(f'Loaded {r["file"]}' + (' (cached)' if from_cache else ''))
+                report_demographics(r['file'], rdf.columns)
+                profiler.add_file(r['file'], stats, rows=len(rdf), cached=from_cache)
+                frames.append(rdf)
+    else:
+        for r in resfiles:
+            print(f'Loading {r["file"]}')
+            (rdf, from_cache), stats = profiler.call(loader, r)
+            if from_cache:
+                print('\tfrom cache')
+            report_demographics(r['file'], rdf.columns)
+            profiler.add_file(r['file'], stats, rows=len(rdf), cached=from_cache)
+            frames.append(rdf)
+    return frames
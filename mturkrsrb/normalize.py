@@ -0,0 +1,278 @@
+"""
+Reduce the demographic answers and timestamps to the values used in the report.
+"""
+
+from datetime import datetime
+from functools import lru_cache
+from typing import Union
+
+from dateutil.parser import parse
+from dateutil.tz import gettz, tzutc
+import numpy as np
+import pandas as pd
+
+
+# For some reason dateutil doesn't know PDT and PST?
+pactz = {'PDT': gettz('America/Los_Angeles'),
+         'PST': gettz('America/Los_Angeles')}
+
+# The same zones as fixed UTC offsets for the vectorized web UI parser
+pacific_offsets = {'PDT': pd.Timedelta(hours=-7),
+                   'PST': pd.Timedelta(hours=-8)}
+
+# Timestamps downloaded from the web UI look like 'Wed Jan 03 10:22:11 PST 2018'
+webui_timestamp = r'^\w{3} (\w{3} +\d{1,2} \d{2}:\d{2}:\d{2}) (PST|PDT) (\d{4})$'
+
+# API timestamps are some flavor of ISO 8601, e.g. '2018-01-03T18:22:11Z'
+iso_timestamp = r'^\d{4}-\d{2}-\d{2}[T ]\d{2}:\d{2}'
+
+# pandas 2 guesses one format from the first ISO timestamp and misses the
+# other flavors unless told to expect any ISO 8601; pandas 1 always accepts
+# any flavor and doesn't know format='ISO8601'
+iso_format = {'format': 'ISO8601'} if int(pd.__version__.split('.')[0]) >= 2 else {}
+
+# Single-valued 'Answer.rsrb.race' codes
+race_codes = {'amerind;': 'American Indian / Alaska Native',
+              'asian;': 'Asian',
+              'black;': 'Black or African American',
+              'other;': 'Other',
+              'pacif;': 'Native Hawaiian or Other Pacific Islander',
+              'white;': 'White'}
+
+# Every value normalize_race can produce
+race_labels = ('American Indian / Alaska Native',
+               'Asian',
+               'Native Hawaiian or Other Pacific Islander',
+               'Black or African American',
+               'White',
+               'More Than One Race',
+               'Unknown or Not Reported',
+               'Other')
+
+# The normalized values for sex and ethnicity
+sex_labels = ('Female', 'Male', 'Unknown or Not Reported')
+
+ethnicity_labels = ('Hisp', 'NonHisp', 'Unknown or Not Reported')
+
+# How the web UI answers are recoded; anything else is left as it is
+sex_codes = {"['Male']": 'Male', "['Female']": 'Female'}
+
+ethnicity_codes = {"['Not Hispanic or Latino']": 'NonHisp',
+                   "['Hispanic or Latino']": 'Hisp',
+                   "['N/A']": np.nan}
+
+# Low-cardinality text columns that are kept as categoricals from the moment
+# a results file is read
+categorical_columns = ('workerid', 'Experiment', 'Experimenter', 'Browser', 'Sex', 'Ethnicity')
+
+# Per-race 'Answer.rsrb.race.*' boolean columns, in the order they are checked
+race_flags = {'amerind': 'American Indian / Alaska Native',
+              'asian': 'Asian',
+              'black': 'Black or African American',
+              'other': 'Other',
+              'pacif': 'Native Hawaiian or Other Pacific Islander',
+              'unknown': 'Unknown or Not Reported',
+              'white': 'White'}
+
+
+def categorize(values: pd.Series, categories=(), ordered: bool = False) -> pd.Series:
+    """
+    Convert a column to a categorical.
+
+    `categories` are the known labels for the column. Any other values found
+    in it (or the categories it already has, if it is a categorical) are
+    added after them in sorted order, so nothing is lost to NA.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        found = values.cat.categories
+    else:
+        found = pd.Index(values.dropna().unique())
+    extra = sort_labels(found[~found.isin(categories)])
+    return set_categories(values, pd.CategoricalDtype(list(categories) + list(extra), ordered=ordered))
+
+
+def sort_labels(labels: pd.Index) -> pd.Index:
+    """Sort labels, as text if they are of types that can't be compared (e.g. numbers and strings)."""
+    try:
+        return labels.sort_values()
+    except TypeError:
+        return pd.Index(sorted(labels, key=str), dtype=object)
+
+
+def set_categories(values: pd.Series, dtype: pd.CategoricalDtype) -> pd.Series:
+    """
+    Convert a column to the categorical `dtype`, recoding it if it is a
+    categorical with the same categories in another order (which pandas
+    considers the same type, unless it is ordered).
+    """
+    if not isinstance(values.dtype, pd.CategoricalDtype):
+        return values.astype(dtype)
+    if values.cat.categories.equals(dtype.categories) and values.cat.ordered == dtype.ordered:
+        return values
+    return values.cat.set_categories(dtype.categories, ordered=dtype.ordered)
+
+
+def recode(values: pd.Series, codes: dict, categories=()) -> pd.Series:
+    """
+    Replace values of a column by the ones in `codes` (NaN to drop them),
+    returning it as a categorical with `categories` first.
+
+    Works on the categories rather than on every row, merging categories
+    that are recoded to the same value.
+    """
+    values = categorize(values)
+    recoded = [codes.get(c, c) for c in values.cat.categories]
+    known = set(categories)
+    extra = sorted({c for c in recoded if pd.notna(c) and c not in known}, key=str)
+    dtype = pd.CategoricalDtype(list(categories) + extra)
+    lookup = np.append(dtype.categories.get_indexer(pd.Index(recoded, dtype=object)), -1)
+    # Code -1 (NA) picks the -1 appended to the lookup
+    return pd.Series(pd.Categorical.from_codes(lookup[values.cat.codes.to_numpy()], dtype=dtype),
+                     index=values.index, name=values.name)
+
+
+def normalize_race(results: pd.DataFrame) -> pd.Series:
+    """
+    Take possible ways race could be specified in RSRB survey and reduce to desired format.
+
+    For calculating racial demographics, the only values we want are:
+      * 'American Indian / Alaska Native',
+      * 'Asian',
+      * 'Black or African American',
+      * 'Other',
+      * 'Native Hawaiian or Other Pacific Islander',
+      * 'Unknown or Not Reported',
+      * 'White'
+      * 'More Than One Race'
+
+    Works on whole columns at once. 'Answer.rsrb.race' either holds a single
+    code, several codes separated by '|', or 'unknown;' when the survey used
+    one 'Answer.rsrb.race.*' column per race instead. Anything else can't be
+    interpreted and is 'Unknown or Not Reported'.
+    """
+    if 'Answer.rsrb.race' in results:
+        race = results['Answer.rsrb.race'].fillna('unknown;').astype(str)
+    else:
+        race = pd.Series('unknown;', index=results.index)
+
+    flags = np.column_stack([
+        results[f'Answer.rsrb.race.{key}'].fillna(False).astype(bool).values
+        if f'Answer.rsrb.race.{key}' in results else np.zeros(len(results), dtype=bool)
+        for key in race_flags])
+    numraces = flags.sum(axis=1)
+    flag_labels = np.array(list(race_flags.values()), dtype=object)
+    from_flags = np.select([numraces > 1, numraces == 0],
+                           ['More Than One Race', 'Unknown or Not Reported'],
+                           flag_labels[flags.argmax(axis=1)])
+
+    single = race.map(race_codes)
+    multi = race.str.contains('|', regex=False, na=False)
+    per_column = race == 'unknown;'
+    normalized = np.select([single.notna().values, multi.values, per_column.values],
+                           [single.values, 'More Than One Race', from_flags],
+                           'Unknown or Not Reported')
+    return pd.Series(normalized, index=results.index, dtype=object)
+
+
+@lru_cache(maxsize=None)
+def parse_timestamp(timestamp: str) -> pd.Timestamp:
+    """
+    Parse a single timestamp with dateutil and convert it to UTC.
+
+    Only used for strings the vectorized parsers in `parse_timestamps` can't
+    handle. Timestamps without time zone information are assumed to be UTC.
+    """
+    try:
+        parsed = pd.Timestamp(parse(timestamp, tzinfos=pactz))
+    except (ValueError, OverflowError):
+        return pd.NaT
+    if parsed.tzinfo is None:
+        return parsed.tz_localize('UTC')
+    return parsed.tz_convert('UTC')
+
+
+def parse_timestamps(timestamps: pd.Series) -> pd.Series:
+    """
+    Convert a column of MTurk timestamp strings to UTC datetimes.
+
+    The known MTurk formats (ISO 8601 from the API, 'Wed Jan 03 10:22:11 PST
+    2018' from the web UI) are converted a column at a time. Anything left
+    over goes through dateutil once per unique string. Values that can't be
+    parsed at all come back as NaT.
+    """
+    timestamps = timestamps.astype(str)
+    parsed = pd.Series(pd.NaT, index=timestamps.index, dtype='datetime64[ns, UTC]')
+
+    iso = timestamps.str.contains(iso_timestamp)
+    if iso.any():
+        parsed[iso] = pd.to_datetime(timestamps[iso], utc=True, errors='coerce', **iso_format)
+
+    webui = timestamps.str.extract(webui_timestamp)
+    webui = webui[webui[0].notna()]
+    if len(webui):
+        local = pd.to_datetime(webui[0] + ' ' + webui[2], format='%b %d %H:%M:%S %Y', errors='coerce')
+        parsed[webui.index] = (local - webui[1].map(pacific_offsets)).dt.tz_localize('UTC')
+
+    leftover = parsed.isna()
+    if leftover.any():
+        parsed[leftover] = pd.to_datetime(timestamps[leftover].map(parse_timestamp), utc=True)
+
+    return parsed
+
+
+def normalize_age(row: pd.core.series.Series) -> Union[int, str]:
+    """Try to make age an integer."""
+    try:
+        return int(float(row['Age']))
+    except ValueError:
+        # print(f'Can't convert: \'{row["Age"]}\'')
+        return row['Age']
+
+
+def normalize_results(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    Reduce the demographic answers of assignments with normalized column
+    names (see `ingest.normalize_columns`) to the values used in the report
+    and add the 'Race' column. The report year is added afterwards by
+    `years.assign_years`.
+
+    Each row is normalized independently of all the others, so this works the
+    same on all assignments at once or on one chunk of a file at a time. A
+    demographic or 'Browser' column missing from `results` is treated as all
+    NA. Sex, Ethnicity, Race and the `categorical_columns` come back as
+    categoricals.
+    """
+    results = results.copy()
+    for col in ('Sex', 'Ethnicity', 'Age', 'Browser'):
+        if col not in results:
+            # Text columns, so the answers below can be written to them
+            results[col] = pd.Series(np.nan, index=results.index, dtype=object)
+
+    results['Sex'] = recode(results['Sex'], sex_codes, sex_labels)
+    results['Ethnicity'] = recode(results['Ethnicity'], ethnicity_codes, ethnicity_labels)
+
+    if 'Answer.rsrb.race' in results:
+        results['Answer.rsrb.race'] = results['Answer.rsrb.race'].fillna('unknown;')
+    else:
+        results['Answer.rsrb.race'] = 'unknown;'
+
+    for key in race_flags:
+        if f'Answer.rsrb.race.{key}' in results:
+            results[f'Answer.rsrb.race.{key}'] = results[f'Answer.rsrb.race.{key}'].fillna(False)
+        else:
+            results[f'Answer.rsrb.race.{key}'] = False
+
+    datedefault = datetime(1970, 1, 1, 0, 0, 0, tzinfo=tzutc()).isoformat()
+    for col in ('assignmentaccepttime', 'assignmentsubmittime', 'creationtime'):
+        if col not in results:
+            results[col] = np.nan
+        results[col] = parse_timestamps(results[col].fillna(datedefault))
+    # results['duration'] = results['assignmentsubmittime'] - results['assignmentaccepttime']
+
+    results['Race'] = categorize(normalize_race(results), race_labels)
+    results['Age'] = results.apply(normalize_age, axis=1)
+    for col in categorical_columns:
+        if col in results and not isinstance(results[col].dtype, pd.CategoricalDtype):
+            results[col] = categorize(results[col])
+
+    return results
@@ -0,0 +1,213 @@
+"""
+Write the report and the raw assignments.
+"""
+
+from datetime import date
+import json
+import sqlite3
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from .enrollment import flatten_columns, overall
+from .formats import output_extensions
+from .normalize import race_flags
+
+# Rows per sheet Excel can open, header included
+excel_max_rows = 1048576
+
+# Rows converted at a time when writing cell by cell or to Arrow
+write_chunksize = 100000
+
+# Column types of the raw assignments in parquet and feather files; every
+# other column is stored as text so that files can't disagree on its type
+raw_timestamp_columns = ('assignmentaccepttime', 'assignmentsubmittime', 'creationtime')
+raw_flag_columns = tuple(f'Answer.rsrb.race.{key}' for key in race_flags)
+
+
+def output_name(protocol: str, kind: str, fmt: str) -> str:
+    """File name of the report or raw assignments (`kind`) of a protocol, written today."""
+    return f'{protocol}_{kind}-{date.today().isoformat()}.{output_extensions[fmt]}'
+
+
+def raw_schema(columns: Iterable[str]):
+    """Arrow schema of the raw assignments with `columns`."""
+    import pyarrow as pa
+    return pa.schema([(c, pa.timestamp('ns', tz='UTC') if c in raw_timestamp_columns else
+                       pa.bool_() if c in raw_flag_columns else pa.string())
+                      for c in columns])
+
+
+def arrow_table(chunk: pd.DataFrame, schema):
+    """Convert raw assignments to an Arrow table with `schema`, whatever the types of the chunk."""
+    import pyarrow as pa
+    arrays = []
+    for field in schema:
+        values = chunk[field.name]
+        if pa.types.is_string(field.type):
+            values = values.astype(object)
+            values = values.where(values.isna(), values.astype(str))
+        elif pa.types.is_boolean(field.type):
+            values = values.astype(object).where(values.notna(), None)
+        arrays.append(pa.array(values, type=field.type, from_pandas=True))
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+class RawWriter:
+    """
+    Write the raw assignments, before removing duplicate workers, a chunk at
+    a time, so they never have to be held in memory all at once.
+
+    Every chunk is written with the same `columns`, missing ones left empty.
+    Use as a context manager, or call `close` when done.
+    """
+
+    def __init__(self, protocol: str, columns: Iterable[str], fmt: str = 'csv'):
+        self.fmt = fmt
+        self.columns = list(columns)
+        self.filename = output_name(protocol, 'rawsubjects', fmt)
+        self.rows = 0
+        self._writer = None
+        if fmt == 'parquet':
+            import pyarrow.parquet as pq
+            self._schema = raw_schema(self.columns)
+            self._writer = pq.ParquetWriter(self.filename, self._schema)
+        elif fmt == 'feather':
+            import pyarrow as pa
+            self._schema = raw_schema(self.columns)
+            self._writer = pa.ipc.new_file(self.filename, self._schema)
+        elif fmt == 'sqlite':
+            self._writer = sqlite3.connect(self.filename)
+            self._writer.execute('DROP TABLE IF EXISTS rawsubjects')
+
+    def write(self, results: pd.DataFrame):
+        """Append assignments to the file."""
+        for start in range(0, len(results), write_chunksize):
+            # Reindexed a chunk at a time so the whole frame is never copied
+            chunk = results.iloc[start:start + write_chunksize].reindex(columns=self.columns)
+            if self.fmt == 'csv':
+                chunk.to_csv(self.filename, mode='a' if self.rows else 'w', header=not self.rows,
+                             # date_format='%Y-%m-%dT%H:%M:%S%z',  # Use ISO 8601 format to make R happy
+                             index=False)
+            elif self.fmt == 'sqlite':
+                chunk.to_sql('rawsubjects', self._writer, if_exists='append', index=False)
+            else:
+                self._writer.write_table(arrow_table(chunk, self._schema))
+            self.rows += len(chunk)
+
+    def close(self):
+        """Finish the file; a CSV file gets its header even if no assignments were written."""
+        if self.fmt == 'csv' and not self.rows:
+            pd.DataFrame(columns=self.columns).to_csv(self.filename, index=False)
+        elif self.fmt == 'sqlite':
+            if not self.rows:
+                pd.DataFrame(columns=self.columns).to_sql('rawsubjects', self._writer, index=False)
+            self._writer.commit()
+        if self._writer is not None:
+            self._writer.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_rows(worksheet, header: List[list], frame: pd.DataFrame, index: bool = False):
+    """
+    Write `header` rows and then the rows of `frame` to a worksheet, one row
+    at a time, which is the order a constant memory workbook needs.
+    """
+    for row, values in enumerate(header):
+        worksheet.write_row(row, 0, values)
+    row = len(header)
+    for start in range(0, len(frame), write_chunksize):
+        chunk = frame.iloc[start:start + write_chunksize].astype(object)
+        for values in chunk.where(chunk.notna(), None).itertuples(index=index, name=None):
+            worksheet.write_row(row, 0, values)
+            row += 1
+
+
+def enrollment_sheet(name: str) -> str:
+    """Name of the report sheet for an enrollment table (Excel allows at most 31 characters)."""
+    return 'Enrollment' if name == overall else f'Enrollment {name}'[:31]
+
+
+def enrollment_header(table: pd.DataFrame) -> List[list]:
+    """Header rows of an enrollment table sheet: ethnicities over sexes, then the race column's name."""
+    ethnicities = table.columns.get_level_values(0)
+    first = [e if i == 0 or e != ethnicities[i - 1] else None for i, e in enumerate(ethnicities)]
+    return [[table.columns.names[0]] + first,
+            [table.columns.names[1]] + list(table.columns.get_level_values(1)),
+            [table.index.name]]
+
+
+def write_xlsx_report(results: pd.DataFrame, protocol: str, tables: Optional[Dict[str, pd.DataFrame]] = None,
+                      workers: bool = True) -> str:
+    """
+    Write the report to an Excel file and return its name.
+
+    The 'Demographic Data' sheet has a row per worker and combination of
+    demographics, which is easy to make pivot tables from; leave it out
+    with `workers=False`. Enrollment `tables` each get a sheet of their own.
+    The workbook is written in xlsxwriter's constant memory mode, a row at a
+    time. Raises a ValueError if the report has more rows than fit on a
+    sheet.
+    """
+    import xlsxwriter
+
+    if workers and len(results) >= excel_max_rows:
+        raise ValueError(f'The report has {len(results)} rows, more than fit on an Excel sheet; '
+                         f'use another --output-format.')
+    outfile_name = output_name(protocol, 'report', 'xlsx')
+    workbook = xlsxwriter.Workbook(outfile_name, {'constant_memory': True, 'remove_timezone': True})
+    if workers:
+        write_rows(workbook.add_worksheet('Demographic Data'), [list(results.columns)], results)
+    for name, table in (tables or {}).items():
+        write_rows(workbook.add_worksheet(enrollment_sheet(name)), enrollment_header(table), table, index=True)
+    workbook.close()
+    return outfile_name
+
+
+def write_report(results: pd.DataFrame, protocol: str, fmt: str = 'xlsx',
+                 tables: Optional[Dict[str, pd.DataFrame]] = None, workers: bool = True) -> str:
+    """
+    Write the report in format `fmt` and return the file name.
+
+    Only Excel reports (see `write_xlsx_report`) have room for the
+    enrollment `tables`; the other formats hold just the report rows, in a
+    'report' table for SQLite.
+    """
+    if fmt == 'xlsx':
+        return write_xlsx_report(results, protocol, tables, workers)
+
+    outfile_name = output_name(protocol, 'report', fmt)
+    if fmt == 'csv':
+        results.to_csv(outfile_name, index=False)
+    elif fmt == 'parquet':
+        results.to_parquet(outfile_name, index=False)
+    elif fmt == 'feather':
+        results.reset_index(drop=True).to_feather(outfile_name)
+    elif fmt == 'sqlite':
+        with sqlite3.connect(outfile_name) as conn:
+            results.to_sql('report', conn, if_exists='replace', index=False)
+        conn.close()
+    return outfile_name
+
+
+def write_enrollment(tables: Dict[str, pd.DataFrame], protocol: str, fmt: str) -> str:
+    """
+    Write the enrollment tables to a CSV or JSON (`fmt`) file and return its name.
+
+    The CSV file has the tables one after another, with the report year (or
+    'All') in the first column. The JSON file maps each year to its table,
+    as {race: {'<ethnicity> <sex>': count}}.
+    """
+    outfile_name = f'{protocol}_enrollment-{date.today().isoformat()}.{fmt}'
+    flat = {name: flatten_columns(table) for name, table in tables.items()}
+    if fmt == 'csv':
+        pd.concat(flat, names=['Year']).to_csv(outfile_name)
+    else:
+        with open(outfile_name, 'w') as efile:
+            json.dump({name: table.to_dict(orient='index') for name, table in flat.items()}, efile, indent=2)
+    return outfile_name
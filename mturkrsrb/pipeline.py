@@ -0,0 +1,326 @@
+"""
+Run the stages of a report: scan, ingest, normalize, assign years, remove
+duplicates, for one config or several at once. Each stage is measured by
+the profiler passed in.
+"""
+
+import importlib.util
+import json
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dedup import compact_results, core_cols, dedup_cols, remove_mismatched_duplicates, report_memory_usage
+from .ingest import (cache_path, concat_results, config_defaults, evict_cache, fill_config_defaults,
+                     normalize_columns, read_options, read_resultsfiles, resultsfile_delimiter)
+from .normalize import categorize, ethnicity_labels, normalize_results, race_labels, sex_labels
+from .output import RawWriter
+from .profiling import Profiler
+from .registry import (changed_resultsfiles, open_registry, reconcile_registry, register_assignments,
+                       register_resultsfiles, registry_report, update_registry_years)
+from .scan import ResultsFileError, planned_resultsfiles, scan_errors, scan_index_file, scan_resultsfiles
+from .stream import stream_resultsfiles
+from .years import assign_years, count_years, report_year_counts
+
+
+def check_resultsfiles(resfiles: List[dict], cache_dir: Optional[str] = None) -> List[dict]:
+    """
+    Scan the results files (see `scan.scan_resultsfiles`) and return them
+    planned for reading, so a broken file stops the run before anything is
+    parsed. The scan index is kept in `cache_dir`, if given.
+
+    Raises a ResultsFileError listing every error found.
+    """
+    entries = scan_resultsfiles(resfiles, scan_index_file(cache_dir))
+    errors = scan_errors(entries)
+    if errors:
+        raise ResultsFileError('\n'.join(errors + [f'{len(errors)} problems with results files; aborting']))
+    for entry in entries:
+        for warning in entry['warnings']:
+            print(f'Warning: {os.path.basename(entry["file"])} {warning}')
+    return planned_resultsfiles(resfiles, entries)
+
+
+def ingest_assignments(resfiles: List[dict], profiler: Profiler, jobs: int = 1, engine: str = 'c',
+                       cache_dir: Optional[str] = None, rebuild_cache: bool = False,
+                       cache_size: int = 2048) -> Tuple[pd.DataFrame, List[int]]:
+    """
+    Run the ingest and normalize stages on all results files, returning
+    every assignment and the number of them from each file.
+
+    If a `cache_dir` is given but pyarrow isn't installed, files aren't
+    cached. `cache_size` is in MB.
+    """
+    if cache_dir is not None:
+        # pandas needs pyarrow for feather files
+        if importlib.util.find_spec('pyarrow') is None:
+            print('pyarrow is not installed; results files will not be cached')
+            cache_dir = None
+        else:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    with profiler.stage('ingest', rows_in=len(resfiles)) as stage:
+        frames = read_resultsfiles(resfiles, jobs, engine, cache_dir, rebuild_cache, profiler)
+        file_rows = [len(rdf) for rdf in frames]
+        # A single concat instead of appending file by file, which copied the
+        # accumulated frame for every file
+        results = concat_results(frames)
+        del frames
+        if cache_dir is not None:
+            evict_cache(cache_dir, {cache_path(r, engine, cache_dir) for r in resfiles},
+                        cache_size * 1024 * 1024)
+        stage['rows_out'] = len(results)
+
+    with profiler.stage('normalize', rows_in=len(results)) as stage:
+        results = normalize_results(results)
+        stage['rows_out'] = len(results)
+    return results, file_rows
+
+
+def add_years(results: pd.DataFrame, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+              profiler: Profiler) -> pd.DataFrame:
+    """Run the year assignment stage."""
+    with profiler.stage('years', rows_in=len(results)) as stage:
+        results = assign_years(results, yearbreaks)
+        report_year_counts(count_years(results['Year']))
+        stage['rows_out'] = len(results)
+    return results
+
+
+def load_assignments(resfiles: List[dict], yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                     profiler: Profiler, jobs: int = 1, engine: str = 'c', cache_dir: Optional[str] = None,
+                     rebuild_cache: bool = False, cache_size: int = 2048) -> pd.DataFrame:
+    """
+    Run the ingest, normalize and year assignment stages on all results
+    files, returning every assignment (see `ingest_assignments`).
+    """
+    results, _ = ingest_assignments(resfiles, profiler, jobs, engine, cache_dir, rebuild_cache, cache_size)
+    return add_years(results, yearbreaks, profiler)
+
+
+def write_rawsubjects(results: pd.DataFrame, protocol: str, raw_format: str, profiler: Profiler):
+    """Write all assignments, before duplicates are removed, to a `raw_format` file."""
+    with profiler.stage('rawsubjects', rows_in=len(results)) as stage:
+        with RawWriter(protocol, results.columns, raw_format) as raw:
+            raw.write(results)
+        stage['rows_out'] = raw.rows
+
+
+def dedup_report(results: pd.DataFrame, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                 profiler: Profiler, streamed_rows: Optional[int] = None, year: Optional[str] = None,
+                 memory_report: bool = False) -> pd.DataFrame:
+    """
+    Run the dedup stage, reducing assignments to the report rows.
+
+    `streamed_rows` is the number of assignments read when `results` is the
+    state left by `stream.stream_resultsfiles`, which has had its first pass
+    of duplicate removal already.
+    """
+    with profiler.stage('dedup', rows_in=len(results)) as stage:
+        results = compact_results(results, yearbreaks)
+        if memory_report:
+            report_memory_usage(results)
+
+        if streamed_rows is not None:
+            print(f'Starting with {streamed_rows} rows.')
+        else:
+            results.sort_values(['workerid', 'Year', ], inplace=True)
+
+            print(f'Starting with {len(results)} rows.')
+
+            # get the oldest instance of each duplicated value
+            results.drop_duplicates(dedup_cols, inplace=True)
+
+            # Only write out the important columns for final Excel file
+            results = results.loc[:, core_cols]
+
+        print(f'After 1st pass removing duplicates there are {len(results)} rows.')
+
+        results = remove_mismatched_duplicates(results)
+
+        print(f'After 2nd pass removing duplicates there are {len(results)} rows.')
+
+        if year is not None:
+            results = results[results['Year'].astype(str) == year]
+        stage['rows_out'] = len(results)
+    return results
+
+
+def registry_results(expdata: dict, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray], profiler: Profiler,
+                     registry: str, jobs: int = 1, engine: str = 'c', year: Optional[str] = None) -> pd.DataFrame:
+    """
+    Add new or changed results files to the `registry` database and return
+    its report rows.
+    """
+    resfiles = expdata['resultsfiles']
+    conn = open_registry(registry)
+    with conn:
+        new_files = changed_resultsfiles(conn, resfiles)
+        print(f'{len(new_files)} of {len(resfiles)} results files are new or have changed')
+        workerids = set()
+        if new_files:
+            results = load_assignments(new_files, yearbreaks, profiler, jobs, engine)
+            with profiler.stage('register', rows_in=len(results)):
+                register_assignments(conn, results)
+                register_resultsfiles(conn, new_files)
+            workerids = set(results['workerid'].dropna())
+            print(f'Registered {len(results)} assignments from {len(workerids)} workers.')
+
+        with profiler.stage('dedup', rows_in=len(workerids)) as stage:
+            # Different datebreaks put every assignment in a different year
+            datebreaks_key = json.dumps(expdata['datebreaks'], default=str, sort_keys=True)
+            registered_key = conn.execute("SELECT value FROM meta WHERE key = 'datebreaks'").fetchone()
+            if registered_key is None or registered_key[0] != datebreaks_key:
+                update_registry_years(conn, yearbreaks)
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('datebreaks', ?)",
+                             (datebreaks_key,))
+                workerids = None
+
+            if workerids is None or workerids:
+                reconcile_registry(conn, workerids, yearbreaks)
+            results = registry_report(conn, yearbreaks, year)
+            stage['rows_out'] = len(results)
+    conn.close()
+    print(f'The registry has {len(results)} report rows.')
+    return results
+
+
+def build_report(expdata: dict, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                 profiler: Optional[Profiler] = None, jobs: int = 1, engine: str = 'c',
+                 cache_dir: Optional[str] = None, rebuild_cache: bool = False, cache_size: int = 2048,
+                 stream: bool = False, chunksize: int = 100000, registry: Optional[str] = None,
+                 year: Optional[str] = None, rawsubjects: bool = False, raw_format: str = 'csv',
+                 memory_report: bool = False) -> pd.DataFrame:
+    """
+    Build the report rows, one per worker and combination of demographics,
+    for the config `expdata` with compiled `yearbreaks`.
+
+    Reads every assignment into memory unless `stream` (see
+    `stream.stream_resultsfiles`) or a `registry` database is given. With
+    `rawsubjects` all assignments are also written out, in the order they
+    were read and before duplicates are removed, to a `raw_format` file
+    (see `output.RawWriter`).
+    """
+    profiler = profiler or Profiler()
+    protocol = expdata['protocol']
+
+    with profiler.stage('scan', rows_in=len(expdata['resultsfiles'])) as stage:
+        resfiles = check_resultsfiles(expdata['resultsfiles'], cache_dir)
+        stage['rows_out'] = len(resfiles)
+
+    if registry is not None:
+        return registry_results(dict(expdata, resultsfiles=resfiles), yearbreaks, profiler, registry, jobs,
+                                engine, year)
+
+    nrows = None
+    if stream:
+        # Reading, normalizing and reducing happen chunk by chunk, so they are one stage
+        with profiler.stage('stream', rows_in=len(resfiles)) as stage:
+            raw = None
+            if rawsubjects:
+                # The same columns in the same order as without --stream
+                columns = normalized_columns(resfiles)
+                raw = RawWriter(protocol, columns.insert(columns.get_loc('Race') + 1, 'Year'), raw_format)
+            try:
+                results, nrows, year_counts = stream_resultsfiles(resfiles, yearbreaks, jobs, engine, chunksize,
+                                                                  profiler, raw)
+            finally:
+                if raw is not None:
+                    raw.close()
+            report_year_counts(year_counts)
+            stage['rows_out'] = len(results)
+    else:
+        results = load_assignments(resfiles, yearbreaks, profiler, jobs, engine, cache_dir, rebuild_cache,
+                                   cache_size)
+        if rawsubjects:
+            write_rawsubjects(results, protocol, raw_format, profiler)
+
+    return dedup_report(results, yearbreaks, profiler, nrows, year, memory_report)
+
+
+def source_key(r: dict) -> Tuple[str, str]:
+    """What makes two config entries read the same results file the same way."""
+    return os.path.abspath(r['file']), resultsfile_delimiter(r)
+
+
+def own_categories(results: pd.DataFrame, fixed: bool = False) -> pd.DataFrame:
+    """
+    Narrow the categoricals of assignments taken out of those read for
+    several configs to the categories a run on them alone gives them.
+
+    Categories found in the results files ('workerid', 'Browser', ...) are
+    narrowed per file, as each file is categorized when it is read, and with
+    `fixed` the columns that have known labels are narrowed after the files
+    are concatenated, as normalizing does.
+    """
+    results = results.copy(deep=False)
+    labels = {'Sex': sex_labels, 'Race': race_labels, 'Ethnicity': ethnicity_labels}
+    for col in results.columns:
+        if isinstance(results[col].dtype, pd.CategoricalDtype) and (col in labels) == fixed:
+            results[col] = categorize(results[col].cat.remove_unused_categories(), labels.get(col, ()))
+    return results
+
+
+def normalized_columns(resfiles: List[dict]) -> pd.Index:
+    """
+    Columns `ingest_assignments` gives the results files of a single config,
+    in order, worked out from their headers by normalizing an empty row per
+    file.
+    """
+    rows = [normalize_columns(pd.DataFrame(np.nan, index=[0], columns=read_options(r)['usecols'], dtype=object), r)
+            for r in resfiles]
+    return normalize_results(pd.concat(rows, ignore_index=True)).columns
+
+
+def build_reports(expdatas: List[dict], yearbreaks: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                  profiler: Optional[Profiler] = None, jobs: int = 1, engine: str = 'c',
+                  cache_dir: Optional[str] = None, rebuild_cache: bool = False, cache_size: int = 2048,
+                  year: Optional[str] = None, rawsubjects: bool = False, raw_format: str = 'csv',
+                  memory_report: bool = False) -> List[pd.DataFrame]:
+    """
+    Build the report rows of several configs, with their compiled
+    `yearbreaks`, in one run, returning them in the same order.
+
+    A results file listed in more than one config (or more than once) is
+    read and normalized only once. Its assignments are then handed to every
+    config entry listing it, with that entry's 'name' and 'experimenter'
+    defaults, and each config gets its own year assignment, duplicate
+    removal and --rawsubjects file, exactly as if it were run on its own.
+    """
+    profiler = profiler or Profiler()
+    sources = {}
+    for expdata in expdatas:
+        for r in expdata['resultsfiles']:
+            # Defaults are filled in per config entry, after reading
+            sources.setdefault(source_key(r), {k: v for k, v in r.items() if k not in config_defaults.values()})
+    print(f'Reading {len(sources)} results files for {len(expdatas)} protocols')
+
+    with profiler.stage('scan', rows_in=len(sources)) as stage:
+        planned = check_resultsfiles(list(sources.values()), cache_dir)
+        stage['rows_out'] = len(planned)
+    assignments, file_rows = ingest_assignments(planned, profiler, jobs, engine, cache_dir, rebuild_cache,
+                                                cache_size)
+    starts = np.cumsum([0] + file_rows)
+    rows_of = {key: (r, starts[i], starts[i + 1]) for i, (key, r) in enumerate(zip(sources, planned))}
+
+    reports = []
+    for expdata, protocol_yearbreaks in zip(expdatas, yearbreaks):
+        print(f'Protocol {expdata["protocol"]}:')
+        with profiler.stage('select', rows_in=len(assignments)) as stage:
+            resfiles = [dict(r, header=rows_of[source_key(r)][0]['header']) for r in expdata['resultsfiles']]
+            # Same columns in the same order as a run on this config alone
+            columns = normalized_columns(resfiles)
+            parts = []
+            for r in resfiles:
+                _, start, end = rows_of[source_key(r)]
+                part = fill_config_defaults(assignments.iloc[start:end], r).reindex(columns=columns)
+                parts.append(own_categories(part))
+            results = own_categories(concat_results(parts), fixed=True)
+            stage['rows_out'] = len(results)
+        results = add_years(results, protocol_yearbreaks, profiler)
+        if rawsubjects:
+            write_rawsubjects(results, expdata['protocol'], raw_format, profiler)
+        reports.append(dedup_report(results, protocol_yearbreaks, profiler, year=year, memory_report=memory_report))
+    return reports
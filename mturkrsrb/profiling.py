@@ -0,0 +1,140 @@
+"""
+Measure wall time, row counts and peak memory of each stage of a report run.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from functools import partial
+import json
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+
+def measured(func: Callable, *args) -> Tuple[Any, Dict[str, float]]:
+    """
+    Call `func(*args)` and return its result along with the wall time and the
+    peak memory traced while it ran.
+
+    Module level so it can be sent to a pool worker process, where it starts
+    tracing memory itself.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    result = func(*args)
+    stats = {'seconds': time.perf_counter() - start,
+             'peak_memory_bytes': tracemalloc.get_traced_memory()[1]}
+    return result, stats
+
+
+def timed(func: Callable, *args) -> Tuple[Any, Dict[str, float]]:
+    """Like `measured`, but only measure the wall time."""
+    start = time.perf_counter()
+    result = func(*args)
+    return result, {'seconds': time.perf_counter() - start}
+
+
+def unmeasured(func: Callable, *args) -> Tuple[Any, None]:
+    """Stand-in for `measured` when not profiling."""
+    return func(*args), None
+
+
+class Profiler:
+    """
+    Collect a record per pipeline stage, and per results file within a stage.
+
+    Memory is measured with tracemalloc, which sees everything allocated
+    through Python, numpy and pandas (but not pyarrow's own buffers). When
+    not `enabled` nothing is measured and `stage` only hands out a record
+    that is thrown away, so the pipeline can use a profiler unconditionally.
+    Without `trace_memory` only wall time is measured, which keeps tracing
+    from slowing down the run (e.g. for benchmarks).
+    """
+
+    def __init__(self, enabled: bool = False, trace_memory: bool = True):
+        self.enabled = enabled
+        self.trace_memory = trace_memory
+        self.started = datetime.now()
+        self.stages = []
+        self._stage = None
+        self._peak = 0
+
+    def _take_peak(self):
+        """Fold the peak since the last reset into the current stage's peak and reset it."""
+        if not self.trace_memory:
+            return
+        self._peak = max(self._peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.reset_peak()
+
+    @contextmanager
+    def stage(self, name: str, rows_in: Optional[int] = None) -> Iterator[dict]:
+        """
+        Measure the code run in the `with` block as stage `name`.
+
+        Yields the stage's record, in which the block should set 'rows_out'.
+        """
+        record = {'stage': name, 'rows_in': rows_in, 'rows_out': None}
+        if not self.enabled:
+            yield record
+            return
+        if self.trace_memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+        self._peak = 0
+        self._stage = record
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if self.trace_memory:
+                self._take_peak()
+                record['peak_memory_bytes'] = self._peak
+            self._stage = None
+            self.stages.append(record)
+
+    def call(self, func: Callable, *args) -> Tuple[Any, Optional[Dict[str, float]]]:
+        """
+        Call `func(*args)` in this process, measuring it on its own if enabled.
+
+        Returns the result and its stats (None if not enabled), which can be
+        passed on to `add_file`.
+        """
+        if not self.enabled:
+            return func(*args), None
+        self._take_peak()
+        result, stats = (measured if self.trace_memory else timed)(func, *args)
+        self._take_peak()
+        return result, stats
+
+    def task(self, func: Callable) -> Callable:
+        """
+        Wrap `func` for a pool of worker processes so that it returns the
+        same (result, stats) pair as `call`.
+        """
+        if not self.enabled:
+            return partial(unmeasured, func)
+        return partial(measured if self.trace_memory else timed, func)
+
+    def add_file(self, filename: str, stats: Optional[Dict[str, float]], **details):
+        """Add the stats of a single results file to the current stage."""
+        if self._stage is None or stats is None:
+            return
+        self._stage.setdefault('files', []).append({'file': filename, **details, **stats})
+
+    def report(self) -> dict:
+        """Everything measured so far, as written by `write`."""
+        return {
+            'started': self.started.isoformat(timespec='seconds'),
+            'total_seconds': sum(s['seconds'] for s in self.stages),
+            'peak_memory_bytes': max((s.get('peak_memory_bytes', 0) for s in self.stages), default=0),
+            'stages': self.stages,
+        }
+
+    def write(self, filename: str, **details):
+        """Write the profile as JSON, with any extra `details` about the run at the top."""
+        with open(filename, 'w') as pfile:
+            json.dump({**details, **self.report()}, pfile, indent=2)
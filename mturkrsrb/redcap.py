@@ -0,0 +1,195 @@
+"""
+Turn a demographic report into records ready for import into REDCap.
+"""
+
+from datetime import date
+import os
+import sqlite3
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+sex_map = {
+    'Female': 0,
+    'Male': 1,
+    'Unknown or Not Reported': 2,
+}
+
+race_map = {
+    'American Indian / Alaska Native': 0,
+    'Asian': 1,
+    'Native Hawaiian or Other Pacific Islander': 2,
+    'Black or African American': 3,
+    'White': 4,
+    'More Than One Race': 5,
+    'Unknown or Not Reported': 6,
+    'Other': 6,
+}
+
+eth_map = {
+    'Hisp': 0,
+    'NonHisp': 1,
+    'Unknown or Not Reported': 2
+}
+
+# REDCap expects the columns in this order
+out_columns = ('record_id', 'mturk_workerid', 'mturk_age', 'mturk_sex', 'mturk_race', 'mturk_ethnicity', 'mturk_demography_form_complete')
+
+
+def read_report(filename: str) -> pd.DataFrame:
+    """
+    Read a demographic report in any of the formats demographic_report.py
+    can write, picked by file extension. Anything else is assumed to be XLSX.
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.csv':
+        return pd.read_csv(filename)
+    elif ext == '.feather':
+        return pd.read_feather(filename)
+    elif ext == '.parquet':
+        return pd.read_parquet(filename)
+    elif ext == '.db':
+        with sqlite3.connect(filename) as conn:
+            report = pd.read_sql_query('SELECT * FROM report', conn)
+        conn.close()
+        return report
+    # Assumes sheet hasn't been renamed
+    return pd.read_excel(filename, 'Demographic Data')
+
+
+def report_protocol(filename: str) -> str:
+    """Get the protocol out of a report file name."""
+    # Assumes file retains name that demographic_repory.py gave it
+    return filename[:filename.index('_')]
+
+
+def record_ids(startindex: int, count: int) -> np.ndarray:
+    """Make `count` consecutive record IDs ('mt0000', 'mt0001', ...) starting at `startindex`."""
+    numbers = np.arange(startindex, startindex + count).astype(str)
+    return pd.Series(numbers, dtype=object).str.zfill(4).radd('mt').values
+
+
+def redcap_records(report: pd.DataFrame, startindex: int = 0) -> pd.DataFrame:
+    """
+    Convert the demographic report into REDCap records.
+
+    All the text gets converted into the numbers REDCap stores them as. If any
+    value has no REDCap code, a ValueError listing every unmapped value per
+    column is raised.
+    """
+    codes = {}
+    unmapped = []
+    for col, out_col, label_map in (('Sex', 'mturk_sex', sex_map),
+                                    ('Race', 'mturk_race', race_map),
+                                    ('Ethnicity', 'mturk_ethnicity', eth_map)):
+        labels = report[col].astype(object)
+        coded = labels.map(label_map)
+        missing = coded.isna()
+        if missing.any():
+            counts = labels[missing].fillna('<empty>').value_counts()
+            unmapped.append(f'{col}: ' + ', '.join(f'{label!r} ({n})' for label, n in counts.items()))
+        codes[out_col] = coded
+    if unmapped:
+        raise ValueError('Values with no REDCap code:\n  ' + '\n  '.join(unmapped))
+
+    out_df = pd.DataFrame({
+        # Each record needs a unique 'record_id'
+        'record_id': record_ids(startindex, len(report)),
+        # REDCap expects a different name
+        'mturk_workerid': report['workerid'].astype(object).values,
+        # Age is pretty useless and mostly not capture so just set it to nothing
+        'mturk_age': np.nan,
+        'mturk_sex': codes['mturk_sex'].astype(int).values,
+        'mturk_race': codes['mturk_race'].astype(int).values,
+        'mturk_ethnicity': codes['mturk_ethnicity'].astype(int).values,
+        'mturk_demography_form_complete': 1,  # This actually maps to "Unverified", but that's fine.
+    })
+    return out_df.reindex(columns=out_columns)
+
+
+def read_ledger(filenames: List[str]) -> pd.DataFrame:
+    """
+    Read the records of earlier REDCap exports.
+
+    Takes any number of export files (or a ledger kept by `update_ledger`);
+    files that don't exist yet are skipped.
+    """
+    frames = [pd.read_csv(f, dtype={'record_id': str, 'mturk_workerid': str})
+              for f in filenames if os.path.exists(f)]
+    if not frames:
+        return pd.DataFrame(columns=out_columns)
+    return pd.concat(frames, ignore_index=True).drop_duplicates('record_id', keep='last')
+
+
+def next_record_index(ledger: pd.DataFrame) -> int:
+    """Return the number after the highest 'mtNNNN' record ID in `ledger`."""
+    numbers = ledger['record_id'].str.extract(r'^mt(\d+)$', expand=False).dropna().astype(int)
+    return int(numbers.max()) + 1 if len(numbers) else 0
+
+
+def delta_records(records: pd.DataFrame, ledger: pd.DataFrame,
+                  updates: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Keep only the records REDCap doesn't have yet.
+
+    Records of workers not in `ledger` are new and get record IDs continuing
+    after the highest one in the ledger. With `updates`, a worker who has a
+    single record in the ledger and a single, different one now gets that
+    record again with the same ID, so the import overwrites it; any other
+    new combination of demographics for a known worker is added as a new
+    record. Returns the new records and the updated ones.
+    """
+    demographics = ['mturk_workerid', 'mturk_sex', 'mturk_race', 'mturk_ethnicity']
+    known = pd.MultiIndex.from_frame(ledger[demographics].astype({c: int for c in demographics[1:]}))
+    unchanged = pd.MultiIndex.from_frame(records[demographics]).isin(known)
+    one_record = ~records['mturk_workerid'].duplicated(keep=False)
+    records = records[~unchanged]
+
+    known_worker = records['mturk_workerid'].isin(ledger['mturk_workerid'])
+    new = records[~known_worker]
+    changed = records[known_worker]
+    updated = changed.iloc[:0]
+    if updates:
+        ledger_ids = ledger.drop_duplicates('mturk_workerid', keep=False).set_index('mturk_workerid')['record_id']
+        single = one_record[changed.index] & changed['mturk_workerid'].isin(ledger_ids.index)
+        updated = changed[single].assign(record_id=changed.loc[single, 'mturk_workerid'].map(ledger_ids).values)
+        new = pd.concat([new, changed[~single]]).sort_index()
+    new = new.assign(record_id=record_ids(next_record_index(ledger), len(new)))
+    return new, updated
+
+
+def update_ledger(filename: str, ledger: pd.DataFrame, new: pd.DataFrame, updated: pd.DataFrame):
+    """Add newly exported records to the ledger file and replace updated ones."""
+    ledger = ledger[~ledger['record_id'].isin(updated['record_id'])]
+    pd.concat([ledger, updated, new], ignore_index=True).reindex(columns=out_columns).to_csv(filename, index=False)
+
+
+def export_redcap(report: pd.DataFrame, protocol: str, startindex: int = 0, previous: Sequence[str] = (),
+                  ledger: Optional[str] = None, updates: bool = False) -> Tuple[str, int, int]:
+    """
+    Write the REDCap import file for a demographic report.
+
+    If earlier exports (`previous`) or a `ledger` file are given, only
+    records REDCap doesn't have yet are written, and the ledger is updated.
+    Returns the file name and the number of new and updated records.
+    """
+    records = redcap_records(report, startindex)
+    if previous or ledger:
+        prior = read_ledger(list(previous) + ([ledger] if ledger else []))
+        new, updated = delta_records(records, prior, updates)
+        if startindex > next_record_index(prior):
+            new = new.assign(record_id=record_ids(startindex, len(new)))
+        if ledger:
+            update_ledger(ledger, read_ledger([ledger]), new, updated)
+        records = pd.concat([new, updated], ignore_index=True)
+    else:
+        new, updated = records, records.iloc[:0]
+    return write_redcap_csv(records, protocol), len(new), len(updated)
+
+
+def write_redcap_csv(records: pd.DataFrame, protocol: str) -> str:
+    """Write REDCap records to the import CSV file and return its name."""
+    outfile_name = f'{protocol}-redcap-{date.today().isoformat()}.csv'
+    records.to_csv(outfile_name, index=False)
+    return outfile_name
@@ -0,0 +1,148 @@
+"""
+Keep every assignment in a SQLite registry that is updated incrementally.
+"""
+
+import os
+import sqlite3
+from typing import List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dedup import compact_results, core_cols, dedup_cols, remove_mismatched_duplicates
+from .years import add_logical_year
+
+
+# Tables of the worker registry. 'assignments' holds every assignment ever
+# loaded; 'workers' the reconciled report rows, recomputed only for workers
+# with new assignments.
+registry_schema = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS files (file TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER);
+CREATE TABLE IF NOT EXISTS assignments (
+    assignmentid TEXT PRIMARY KEY,
+    workerid TEXT, hitid TEXT, hittypeid TEXT, title TEXT,
+    assignmentaccepttime TEXT, assignmentsubmittime TEXT,
+    Sex TEXT, Race TEXT, Ethnicity TEXT, Age TEXT, Year TEXT,
+    Experiment TEXT, Experimenter TEXT, Browser TEXT
+);
+CREATE INDEX IF NOT EXISTS assignments_workerid ON assignments (workerid);
+CREATE TABLE IF NOT EXISTS workers (workerid TEXT, Sex TEXT, Race TEXT, Ethnicity TEXT, Year TEXT);
+CREATE INDEX IF NOT EXISTS workers_workerid ON workers (workerid);
+CREATE INDEX IF NOT EXISTS workers_year ON workers (Year);
+"""
+
+registry_columns = ('assignmentid', 'workerid', 'hitid', 'hittypeid', 'title',
+                    'assignmentaccepttime', 'assignmentsubmittime',
+                    'Sex', 'Race', 'Ethnicity', 'Age', 'Year',
+                    'Experiment', 'Experimenter', 'Browser')
+
+
+def sql_values(values: pd.Series) -> pd.Series:
+    """Convert a column to plain Python values sqlite3 can store, with None for NA."""
+    if hasattr(values, 'dt'):
+        values = values.dt.strftime('%Y-%m-%dT%H:%M:%S%z')
+    values = values.astype(object)
+    return values.where(values.notna(), None)
+
+
+def open_registry(filename: str) -> sqlite3.Connection:
+    """Open (and create if needed) a worker registry database."""
+    conn = sqlite3.connect(filename)
+    conn.executescript(registry_schema)
+    return conn
+
+
+def changed_resultsfiles(conn: sqlite3.Connection, resfiles: List[dict]) -> List[dict]:
+    """Return the results files that are new or have changed since they were last registered."""
+    registered = {row[0]: row[1:] for row in conn.execute('SELECT file, size, mtime_ns FROM files')}
+    changed = []
+    for r in resfiles:
+        stat = os.stat(r['file'])
+        if registered.get(os.path.abspath(r['file'])) != (stat.st_size, stat.st_mtime_ns):
+            changed.append(r)
+    return changed
+
+
+def register_resultsfiles(conn: sqlite3.Connection, resfiles: List[dict]):
+    """Record the current size and modification time of results files."""
+    rows = []
+    for r in resfiles:
+        stat = os.stat(r['file'])
+        rows.append((os.path.abspath(r['file']), stat.st_size, stat.st_mtime_ns))
+    conn.executemany('INSERT INTO files (file, size, mtime_ns) VALUES (?, ?, ?) '
+                     'ON CONFLICT (file) DO UPDATE SET size = excluded.size, mtime_ns = excluded.mtime_ns',
+                     rows)
+
+
+def register_assignments(conn: sqlite3.Connection, results: pd.DataFrame):
+    """
+    Insert normalized assignments into the registry, updating any that are
+    already there.
+    """
+    columns = [c for c in registry_columns if c in results]
+    values = pd.DataFrame({c: sql_values(results[c]) for c in columns})
+    updates = ', '.join(f'{c} = excluded.{c}' for c in columns if c != 'assignmentid')
+    conn.executemany(f'INSERT INTO assignments ({", ".join(columns)}) '
+                     f'VALUES ({", ".join("?" * len(columns))}) '
+                     f'ON CONFLICT (assignmentid) DO UPDATE SET {updates}',
+                     values.itertuples(index=False, name=None))
+
+
+def update_registry_years(conn: sqlite3.Connection, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+    """Assign every registered assignment to a report year again, e.g. after the datebreaks changed."""
+    submitted = pd.read_sql_query('SELECT rowid, assignmentsubmittime FROM assignments', conn)
+    years = add_logical_year(pd.to_datetime(submitted['assignmentsubmittime'], utc=True), yearbreaks)
+    conn.executemany('UPDATE assignments SET Year = ? WHERE rowid = ?',
+                     zip(sql_values(years.astype(str)), submitted['rowid'].tolist()))
+
+
+def reconcile_registry(conn: sqlite3.Connection, workerids: Optional[Set[str]],
+                       yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray]):
+    """
+    Recompute the report rows of the given workers (or all workers if
+    `workerids` is None) from their registered assignments.
+
+    Duplicates are removed per worker, so the rows of other workers never
+    change. Assignments are taken in the order they were registered, which
+    matches the order they would be loaded in from the config.
+    """
+    query = 'SELECT a.rowid AS _order, a.workerid, a.Sex, a.Race, a.Ethnicity, a.Year FROM assignments a'
+    if workerids is not None:
+        conn.execute('CREATE TEMP TABLE IF NOT EXISTS affected (workerid TEXT PRIMARY KEY)')
+        conn.execute('DELETE FROM affected')
+        conn.executemany('INSERT OR IGNORE INTO affected VALUES (?)', ((w,) for w in workerids))
+        query += ' JOIN affected USING (workerid)'
+    assignments = pd.read_sql_query(query, conn)
+
+    # Years are stored as text; map them back to the labels in the config
+    labels = {str(y): y for y in list(yearbreaks[2]) + ['Date unparseable', 'Date out of range']}
+    assignments['Year'] = assignments['Year'].map(labels)
+
+    assignments = compact_results(assignments, yearbreaks)
+    assignments.sort_values(['workerid', 'Year', '_order'], inplace=True)
+    assignments.drop_duplicates(dedup_cols, inplace=True)
+    reconciled = remove_mismatched_duplicates(assignments.loc[:, core_cols])
+
+    if workerids is None:
+        conn.execute('DELETE FROM workers')
+    else:
+        conn.execute('DELETE FROM workers WHERE workerid IN (SELECT workerid FROM affected)')
+    values = pd.DataFrame({c: sql_values(reconciled[c]) for c in core_cols})
+    values['Year'] = sql_values(reconciled['Year'].astype(str))
+    conn.executemany('INSERT INTO workers (workerid, Sex, Race, Ethnicity, Year) VALUES (?, ?, ?, ?, ?)',
+                     values.itertuples(index=False, name=None))
+
+
+def registry_report(conn: sqlite3.Connection, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                    year=None) -> pd.DataFrame:
+    """Read the reconciled report rows out of the registry, for all years or just `year`."""
+    query = 'SELECT workerid, Sex, Race, Ethnicity, Year FROM workers'
+    params = ()
+    if year is not None:
+        query += ' WHERE Year = ?'
+        params = (str(year),)
+    report = pd.read_sql_query(query + ' ORDER BY workerid, rowid', conn, params=params)
+    labels = {str(y): y for y in list(yearbreaks[2]) + ['Date unparseable', 'Date out of range']}
+    report['Year'] = report['Year'].map(labels)
+    return report
@@ -0,0 +1,230 @@
+"""
+Check every results file from its header and first lines only, before (or
+instead of) reading any of them in full.
+"""
+
+import csv
+import io
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from .ingest import CSI, alias_of, columns_of_interest, resultsfile_delimiter
+
+# Bytes first read from the start of each file, and the number of complete
+# rows after the header to read at least (or the whole file), to check the
+# field counts and estimate the number of rows even when rows are large
+scan_bytes = 65536
+scan_records = 100
+
+# File name of the scan index in the cache directory
+scan_index_name = 'scan-index.json'
+
+# Bump whenever scan_resultsfile's output changes so stale index entries are
+# never used
+scan_index_version = 2
+
+delimiter_names = {'\t': 'tab', ',': 'comma'}
+
+
+class ResultsFileError(ValueError):
+    """Raised when a scan finds results files that can't be read."""
+
+
+def sample_records(filename: str, delim: str) -> Tuple[List[List[str]], bool, List[int]]:
+    """
+    Read the start of a results file, at least `scan_bytes` and more until it
+    has the header and `scan_records` complete rows, and return its records,
+    whether that was the whole file and the byte offset each record ends at.
+    """
+    size = scan_bytes
+    sample = b''
+    with open(filename, 'rb') as resfile:
+        while True:
+            sample += resfile.read(size - len(sample))
+            complete = len(sample) < size
+            records, ends = split_records(sample, delim)
+            if not complete:
+                # The last record may have been cut off
+                records, ends = records[:-1], ends[:-1]
+            if complete or len(records) > scan_records:
+                return records, complete, ends
+            size *= 2
+
+
+def split_records(sample: bytes, delim: str) -> Tuple[List[List[str]], List[int]]:
+    """Split bytes into records, along with the byte offset each one ends at."""
+    consumed = 0
+
+    def lines():
+        nonlocal consumed
+        for line in io.BytesIO(sample):
+            consumed += len(line)
+            yield line.decode('utf-8', errors='replace')
+
+    records, ends = [], []
+    # A quoted field can span lines, so the offset is taken after each record
+    for record in csv.reader(lines(), delimiter=delim):
+        records.append(record)
+        ends.append(consumed)
+    return records, ends
+
+
+def scan_resultsfile(r: dict) -> dict:
+    """
+    Scan a results file without parsing it: its columns, the columns the
+    report will read, its layout (API or web UI column names, one race
+    column or one per race), whether it has demographics and about how many
+    rows it has.
+
+    Anything that would make reading the file fail or give a useless report
+    is listed under 'errors': a missing or empty file, a header that doesn't
+    split on the configured delimiter, no worker ID column, or rows with
+    more fields than the header. Rows with fewer fields are 'warnings'.
+    """
+    delim = resultsfile_delimiter(r)
+    entry = {'file': os.path.abspath(r['file']), 'delimiter': delimiter_names[delim],
+             'columns': [], 'usecols': [], 'names': None, 'race': None, 'demographics': False,
+             'rows': 0, 'exact_rows': False, 'errors': [], 'warnings': []}
+    try:
+        stat = os.stat(r['file'])
+        records, complete, ends = sample_records(r['file'], delim)
+    except OSError as e:
+        entry['errors'].append(f'cannot be read: {e.strerror}')
+        return entry
+    entry.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+
+    if not records:
+        entry['errors'].append('is empty')
+        return entry
+    header, rows = records[0], records[1:]
+    entry['columns'] = header
+    if len(header) == 1:
+        other = '\t' if delim == ',' else ','
+        if other in header[0]:
+            entry['errors'].append(f'header does not split on {delimiter_names[delim]}s but does on '
+                                   f'{delimiter_names[other]}s; check its delimiter in the config')
+
+    names = {alias_of[c] for c in header if c in columns_of_interest}
+    entry['usecols'] = [c for c in header if c in columns_of_interest]
+    entry['names'] = 'webui' if 'WorkerId' in header else 'api' if 'workerid' in header else None
+    entry['race'] = ('columns' if any(c.startswith('Answer.rsrb.race.') for c in names) else
+                     'single' if 'Answer.rsrb.race' in names else None)
+    entry['demographics'] = 'Ethnicity' in names
+    if 'workerid' not in names and not entry['errors']:
+        entry['errors'].append('has no worker ID column')
+
+    long_rows = sum(len(row) > len(header) for row in rows)
+    short_rows = sum(0 < len(row) < len(header) for row in rows)
+    if long_rows:
+        entry['errors'].append(f'{long_rows} of the first {len(rows)} rows have more fields than the header')
+    if short_rows:
+        entry['warnings'].append(f'{short_rows} of the first {len(rows)} rows have fewer fields than the header')
+
+    rows = [row for row in rows if row]
+    if complete:
+        entry['rows'], entry['exact_rows'] = len(rows), True
+    elif rows:
+        # From the average size of the rows read
+        entry['rows'] = round(len(rows) * (stat.st_size - ends[0]) / (ends[-1] - ends[0]))
+    return entry
+
+
+def scan_index_file(cache_dir: Optional[str]) -> Optional[str]:
+    """Return where the scan index is kept in `cache_dir`, creating it if needed; None without one."""
+    if cache_dir is None:
+        return None
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, scan_index_name)
+
+
+def read_scan_index(filename: Optional[str]) -> Dict[str, dict]:
+    """Read the scan index, mapping results file paths to their entries."""
+    if filename is None or not os.path.exists(filename):
+        return {}
+    try:
+        with open(filename) as ifile:
+            index = json.load(ifile)
+    except (OSError, ValueError) as e:
+        print(f'Ignoring unreadable scan index {filename}: {e}')
+        return {}
+    return index['files'] if index.get('version') == scan_index_version else {}
+
+
+def write_scan_index(filename: str, index: Dict[str, dict]):
+    """Write the scan index, replacing the old one in one go."""
+    partial_path = f'{filename}.{os.getpid()}.tmp'
+    with open(partial_path, 'w') as ifile:
+        json.dump({'version': scan_index_version, 'files': index}, ifile)
+    os.replace(partial_path, filename)
+
+
+def scan_resultsfiles(resfiles: List[dict], index_file: Optional[str] = None) -> List[dict]:
+    """
+    Scan every results file in the config and return their entries, in
+    config order.
+
+    With an `index_file`, files whose size, modification time and delimiter
+    haven't changed since they were last scanned aren't opened at all, and
+    the index is updated with the new entries.
+    """
+    index = read_scan_index(index_file)
+    entries = []
+    for r in resfiles:
+        path = os.path.abspath(r['file'])
+        entry = index.get(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            stat = None
+        if (entry is None or stat is None or entry.get('size') != stat.st_size or
+                entry.get('mtime_ns') != stat.st_mtime_ns or
+                entry['delimiter'] != delimiter_names[resultsfile_delimiter(r)]):
+            entry = scan_resultsfile(r)
+            if 'size' in entry:
+                index[path] = entry
+        entries.append(entry)
+    if index_file is not None:
+        try:
+            write_scan_index(index_file, index)
+        except OSError as e:
+            print(f'Could not write scan index {index_file}: {e}')
+    return entries
+
+
+def scan_errors(entries: List[dict]) -> List[str]:
+    """Return a line per problem that would make reading a results file fail."""
+    return [f'{entry["file"]} {error}' for entry in entries for error in entry['errors']]
+
+
+def planned_resultsfiles(resfiles: List[dict], entries: List[dict]) -> List[dict]:
+    """
+    Return copies of the config's results file entries with the header from
+    their scan, so the full run can pick columns without reading it again.
+    """
+    return [dict(r, header=entry['columns']) for r, entry in zip(resfiles, entries)]
+
+
+def report_scan(entries: List[dict]):
+    """Print a line per results file, its problems, and a summary."""
+    for entry in entries:
+        filename = os.path.basename(entry['file'])
+        if entry['errors']:
+            print(CSI + '31;40m' + '!' + CSI + '0m' + f'\t{filename}')
+        else:
+            mark = CSI + ('32;40m' + '✓' if entry['demographics'] else '31;40m' + '✗') + CSI + '0m'
+            race = {'columns': ', a column per race', 'single': ', one race column'}.get(entry['race'], '')
+            rows = entry['rows'] if entry['exact_rows'] else f'about {entry["rows"]}'
+            print(f'{mark}\t{filename}: {entry["delimiter"]} delimited, {entry["names"]} column names{race}, '
+                  f'{rows} rows, {len(entry["usecols"])} of {len(entry["columns"])} columns read' +
+                  ('' if entry['demographics'] else ', no demographic information'))
+        for error in entry['errors']:
+            print(f'\t  error: {error}')
+        for warning in entry['warnings']:
+            print(f'\t  warning: {warning}')
+
+    total = sum(entry['rows'] for entry in entries if not entry['errors'])
+    missing = sum(not entry['demographics'] for entry in entries if not entry['errors'])
+    failed = sum(bool(entry['errors']) for entry in entries)
+    print(f'Scanned {len(entries)} results files with about {total} assignments; '
+          f'{missing} without demographic information, {failed} with errors')
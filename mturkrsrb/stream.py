@@ -0,0 +1,112 @@
+"""
+Read results files in chunks, keeping only per-worker state in memory.
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from .dedup import core_cols, dedup_cols
+from .ingest import concat_results, normalize_columns, read_options, report_demographics
+from .normalize import categorize, normalize_results
+from .output import RawWriter
+from .profiling import Profiler
+from .years import assign_years, count_years, sum_year_counts
+
+
+def reduce_assignments(state: Optional[pd.DataFrame], chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Fold a chunk of normalized assignments into the per-worker streaming state.
+
+    The state holds one row per distinct ('workerid', 'Sex', 'Race',
+    'Ethnicity') combination: the row with the lowest 'Year', earliest in the
+    input ('_order') on ties. That is exactly what sorting all assignments and
+    dropping duplicates keeps, so the state stays as small as the number of
+    workers instead of growing with the number of assignments.
+    """
+    if state is not None:
+        chunk = concat_results([state, chunk])
+    return chunk.sort_values(['Year', '_order']).drop_duplicates(dedup_cols)
+
+
+def stream_resultsfile(r: dict, fileno: int, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                       engine: str = 'c', chunksize: int = 100000,
+                       raw: Optional[RawWriter] = None) -> Tuple[Optional[pd.DataFrame], int, pd.Series]:
+    """
+    Read and reduce a results file a chunk at a time.
+
+    Returns the streaming state for the file (see `reduce_assignments`), the
+    number of assignments read and the number of rows per report year.
+    `fileno` is the file's position in the config, used to keep track of the
+    input order across files. Each normalized chunk is also written to `raw`.
+    """
+    state = None
+    nrows = 0
+    year_counts = []
+    for chunk in pd.read_csv(r['file'], chunksize=chunksize, **read_options(r, engine)):
+        if not len(chunk):
+            continue
+        chunk = assign_years(normalize_results(normalize_columns(chunk, r)), yearbreaks)
+        nrows += len(chunk)
+        year_counts.append(count_years(chunk['Year']))
+        if raw is not None:
+            raw.write(chunk)
+        chunk = chunk.loc[:, core_cols]
+        # Chunks keep counting up the row index, so this is unique per file
+        chunk['_order'] = fileno * 2**40 + chunk.index
+        state = reduce_assignments(state, chunk)
+    return state, nrows, sum_year_counts(year_counts)
+
+
+def stream_resultsfiles(resfiles: List[dict], yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray],
+                        jobs: int = 1, engine: str = 'c', chunksize: int = 100000,
+                        profiler: Optional[Profiler] = None,
+                        raw: Optional[RawWriter] = None) -> Tuple[pd.DataFrame, int, pd.Series]:
+    """
+    Stream every results file listed in the config.
+
+    Never holds more than one chunk of assignments per process plus the
+    reduced per-worker state. Returns the same rows the first duplicate
+    removal pass leaves over the full, sorted results (restricted to
+    `core_cols`), along with the total number of assignments and the number
+    of rows per report year. Each file is recorded in the current stage of
+    `profiler`. All assignments are written to `raw` as they are read,
+    which only works in this process, so not with `jobs` > 1.
+    """
+    if raw is not None and jobs > 1:
+        raise ValueError('Raw assignments can only be written while streaming with a single job')
+    profiler = profiler or Profiler()
+    streamer = partial(stream_resultsfile, yearbreaks=yearbreaks, engine=engine, chunksize=chunksize, raw=raw)
+    state = None
+    nrows = 0
+    year_counts = []
+
+    def fold(r, streamed, stats):
+        nonlocal state, nrows
+        file_state, file_rows, file_years = streamed
+        report_demographics(r['file'], read_options(r, engine)['usecols'])
+        profiler.add_file(r['file'], stats, rows=file_rows)
+        nrows += file_rows
+        year_counts.append(file_years)
+        if file_state is not None:
+            state = reduce_assignments(state, file_state)
+
+    if jobs > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            for r, streamed in zip(resfiles, pool.map(profiler.task(streamer), resfiles, range(len(resfiles)))):
+                print(f'Streamed {r["file"]}')
+                fold(r, *streamed)
+    else:
+        for fileno, r in enumerate(resfiles):
+            print(f'Streaming {r["file"]}')
+            fold(r, *profiler.call(streamer, r, fileno))
+
+    if state is None:
+        state = pd.DataFrame(columns=core_cols + ('_order',))
+    # Sorted categories, so workers come out in the order of their IDs
+    state['workerid'] = categorize(state['workerid'])
+    state = state.sort_values(['workerid', 'Year', '_order']).drop(columns='_order')
+    return state.reset_index(drop=True), nrows, sum_year_counts(year_counts)
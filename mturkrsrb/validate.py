@@ -0,0 +1,137 @@
+"""
+Check configs without reading any results file, and without importing
+pandas or numpy, so a bad config is caught in well under a second instead
+of after (or in the middle of) a long run.
+"""
+
+from datetime import date, datetime, time, timedelta
+import os
+from typing import List, Optional, Tuple
+
+from ruamel.yaml import YAMLError
+
+from .config import load_config
+
+# Values of 'delimiter' in a results file entry; without one files are tab delimited
+delimiter_values = ('tab', 'comma')
+
+
+def config_date(value) -> Optional[datetime]:
+    """A start or end date from the config as a naive datetime, or None if it isn't one."""
+    if isinstance(value, datetime):
+        return value.replace(tzinfo=None)
+    if isinstance(value, date):
+        return datetime.combine(value, time())
+    if isinstance(value, str):
+        try:
+            return datetime.fromisoformat(value).replace(tzinfo=None)
+        except ValueError:
+            return None
+    return None
+
+
+def validate_datebreaks(datebreaks) -> Tuple[List[str], List[str]]:
+    """
+    Check 'datebreaks' the way `years.compile_datebreaks` will, returning
+    the problems and warnings found: every range needs a 'start' and 'end'
+    date (YYYY-MM-DD), may not end before it starts, and may not overlap
+    another. Gaps between ranges are only warnings.
+    """
+    if not isinstance(datebreaks, dict) or not datebreaks:
+        return ['datebreaks has no date ranges'], []
+    problems = []
+    warnings = []
+    ranges = []
+    for year, drange in datebreaks.items():
+        if not isinstance(drange, dict):
+            problems.append(f'date range for {year} needs a start and an end')
+            continue
+        dates = []
+        for key in ('start', 'end'):
+            if key not in drange:
+                problems.append(f'date range for {year} has no {key}')
+            elif config_date(drange[key]) is None:
+                problems.append(f'{key} of date range for {year} is not a YYYY-MM-DD date: {drange[key]!r}')
+            else:
+                dates.append(config_date(drange[key]))
+        if len(dates) == 2:
+            start, end = dates
+            if end < start:
+                problems.append(f'date range for {year} ends ({end.date()}) before it starts ({start.date()})')
+            else:
+                ranges.append((start, end, year))
+
+    ranges.sort(key=lambda r: r[:2])
+    for (_, prev_end, prev_year), (start, _, year) in zip(ranges, ranges[1:]):
+        if start <= prev_end:
+            problems.append(f'date ranges for {prev_year} and {year} overlap')
+        elif start - prev_end > timedelta(days=1):
+            warnings.append(f'gap between {prev_year} and {year} date ranges '
+                            f'({(prev_end + timedelta(days=1)).date()} to {(start - timedelta(days=1)).date()})')
+    return problems, warnings
+
+
+def validate_resultsfiles(resfiles) -> List[str]:
+    """
+    Check that 'resultsfiles' lists results files that exist and can be
+    read, each with a valid 'delimiter' if it has one.
+    """
+    if not isinstance(resfiles, list) or not resfiles:
+        return ['resultsfiles has no results files']
+    problems = []
+    for i, r in enumerate(resfiles, 1):
+        if not isinstance(r, dict) or 'file' not in r:
+            problems.append(f'results file entry {i} has no file')
+            continue
+        filename = str(r['file'])
+        if not os.path.exists(filename):
+            problems.append(f'{filename} does not exist')
+        elif not os.path.isfile(filename):
+            problems.append(f'{filename} is not a file')
+        elif not os.access(filename, os.R_OK):
+            problems.append(f'{filename} cannot be read')
+        if 'delimiter' in r and r['delimiter'] not in delimiter_values:
+            problems.append(f'{filename} has delimiter {r["delimiter"]!r}; use one of {", ".join(delimiter_values)}')
+    return problems
+
+
+def validate_config(filename: str) -> Tuple[Optional[dict], List[str], List[str]]:
+    """
+    Check a config (HIT) file, returning it (None if it can't be loaded)
+    along with the problems and warnings found.
+    """
+    try:
+        expdata = load_config(filename)
+    except (OSError, YAMLError) as e:
+        return None, [f'cannot be loaded: {e}'], []
+    except ValueError as e:
+        return None, str(e).splitlines(), []
+
+    problems = []
+    if not isinstance(expdata['protocol'], str) or not expdata['protocol']:
+        problems.append('protocol is not a name')
+    problems += validate_resultsfiles(expdata['resultsfiles'])
+    date_problems, warnings = validate_datebreaks(expdata['datebreaks'])
+    return expdata, problems + date_problems, warnings
+
+
+def validate_configs(filenames: List[str]) -> bool:
+    """Check every config, printing what is wrong with each; return whether they are all fine."""
+    valid = True
+    protocols = {}
+    for filename in filenames:
+        expdata, problems, warnings = validate_config(filename)
+        if expdata is not None and isinstance(expdata['protocol'], str):
+            if expdata['protocol'] in protocols:
+                problems.append(f'has the same protocol as {protocols[expdata["protocol"]]}')
+            protocols.setdefault(expdata['protocol'], filename)
+        for warning in warnings:
+            print(f'{filename}: warning: {warning}')
+        for problem in problems:
+            print(f'{filename}: {problem}')
+        if problems:
+            valid = False
+        else:
+            print(f'{filename}: OK ({len(expdata["resultsfiles"])} results files, '
+                  f'{len(expdata["datebreaks"])} report years)')
+    return valid
@@ -0,0 +1,111 @@
+"""
+Sort assignments into the report years given by the datebreaks in the config.
+"""
+
+from typing import List, Tuple
+
+import numpy as np
+import pandas as pd
+
+# MTurk and its web UI keep time in Pacific time, so report years change at
+# midnight there
+report_timezone = 'America/Los_Angeles'
+
+
+def compile_datebreaks(datebreaks: dict) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Turn the 'datebreaks' config into sorted arrays of range starts, ends and
+    report year labels.
+
+    Raises a ValueError if there are no ranges, if a range ends before it
+    starts or if two ranges overlap, since a date could then belong to more
+    than one year. Gaps between ranges are allowed but reported, as dates
+    falling in them end up 'Date out of range'.
+    """
+    if not datebreaks:
+        raise ValueError('No date ranges in datebreaks')
+    ranges = sorted(((pd.Timestamp(drange['start']), pd.Timestamp(drange['end']), year)
+                     for year, drange in datebreaks.items()),
+                    key=lambda r: r[:2])
+    for start, end, year in ranges:
+        if end < start:
+            raise ValueError(f'Date range for {year} ends ({end.date()}) before it starts ({start.date()})')
+    for (_, prev_end, prev_year), (start, _, year) in zip(ranges, ranges[1:]):
+        if start <= prev_end:
+            raise ValueError(f'Date ranges for {prev_year} and {year} overlap')
+        if start - prev_end > pd.Timedelta(days=1):
+            print(f'Warning: gap between {prev_year} and {year} date ranges '
+                  f'({(prev_end + pd.Timedelta(days=1)).date()} to {(start - pd.Timedelta(days=1)).date()})')
+    starts = np.array([r[0] for r in ranges], dtype='datetime64[ns]')
+    ends = np.array([r[1] for r in ranges], dtype='datetime64[ns]')
+    years = np.array([r[2] for r in ranges], dtype=object)
+    return starts, ends, years
+
+
+def add_logical_year(submittimes: pd.Series,
+                     yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> pd.Series:
+    """
+    The 'year' for the purpose of a given report may not be equivalent to the
+    calendar year. Take the breakpoints specified in the config file and set
+    the year for each row based on those.
+
+    `yearbreaks` is the output of `compile_datebreaks`. Ranges are inclusive
+    of both their start and end dates, which are Pacific dates: a web UI
+    time like 'Thu May 31 18:12:59 PDT 2018', or the same time from the API,
+    '2018-06-01T01:12:59Z', is on May 31 even though it is June 1 in UTC.
+    Each submit date is located with a binary search over the sorted range
+    starts.
+    """
+    starts, ends, years = yearbreaks
+    submitdates = submittimes.dt.tz_convert(report_timezone).dt.tz_localize(None).dt.floor('D').values
+
+    # Index of the last range starting on or before each date
+    pos = starts.searchsorted(submitdates, side='right') - 1
+    in_range = (pos >= 0) & (submitdates <= ends[pos.clip(0)])
+    unparseable = pd.isnull(submitdates)
+
+    logical_year = np.select([unparseable, in_range],
+                             ['Date unparseable', years[pos.clip(0)]],
+                             'Date out of range')
+    return pd.Series(logical_year, index=submittimes.index, dtype=object)
+
+
+def year_dtype(yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> pd.CategoricalDtype:
+    """
+    The categorical type of 'Year': every label `add_logical_year` can give,
+    ordered so that the lowest year of a worker can be taken.
+    """
+    labels = list(yearbreaks[2]) + ['Date unparseable', 'Date out of range']
+    return pd.CategoricalDtype(sorted(labels, key=str), ordered=True)
+
+
+def assign_years(results: pd.DataFrame, yearbreaks: Tuple[np.ndarray, np.ndarray, np.ndarray]) -> pd.DataFrame:
+    """
+    Add the 'Year' column to normalized results, right after 'Race', as a
+    categorical (see `year_dtype`).
+
+    Like normalizing, this only looks at each row by itself, so it works on
+    a chunk of a file as well as on all assignments.
+    """
+    results.insert(results.columns.get_loc('Race') + 1, 'Year',
+                   add_logical_year(results['assignmentsubmittime'], yearbreaks).astype(year_dtype(yearbreaks)))
+    return results
+
+
+def count_years(years: pd.Series) -> pd.Series:
+    """Count the rows per report year label in a 'Year' column, in the order the labels first appear."""
+    counts = years.cat.codes.value_counts(sort=False)
+    return pd.Series(counts.values, index=years.cat.categories[counts.index])
+
+
+def report_year_counts(year_counts: pd.Series):
+    """Print how many rows were assigned to each report year label."""
+    for label, count in year_counts.items():
+        print(f'{count} rows in {label}')
+
+
+def sum_year_counts(year_counts: List[pd.Series]) -> pd.Series:
+    """Add up several per-year row counts."""
+    if not year_counts:
+        return pd.Series(dtype=int)
+    return pd.concat(year_counts).groupby(level=0, sort=False).sum()
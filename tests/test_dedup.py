@@ -0,0 +1,89 @@
+"""
+Tests of mturkrsrb.dedup.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mturkrsrb.dedup import compact_results, core_cols, dedup_cols, remove_mismatched_duplicates
+from mturkrsrb.years import compile_datebreaks
+
+datebreaks = {'2016-2017': {'start': '2016-06-01', 'end': '2017-05-31'},
+              '2017-2018': {'start': '2017-06-01', 'end': '2018-05-31'},
+              '2018-2019': {'start': '2018-06-01', 'end': '2019-05-31'}}
+
+
+def loop_remove_mismatched_duplicates(results: pd.DataFrame) -> pd.DataFrame:
+    """
+    The second duplicate removal pass as it was first written, scanning the
+    frame once per duplicated worker; kept as the reference for
+    `remove_mismatched_duplicates`.
+    """
+    results = results.copy()
+    results.replace(['Unknown', 'Unknown or Not Reported'], np.nan, inplace=True)
+    dupes = results.loc[results.duplicated('workerid', keep=False)]  # default is to not mark 1st instance
+    for w in dupes['workerid'].unique():
+        worker_rows = results[results['workerid'] == w]
+
+        # For year, take lowest
+        results.loc[worker_rows.index, 'Year'] = sorted(worker_rows['Year'].dropna().tolist())[0]
+
+        # For sex, race, and ethnicity: if only one non-NA value set all to it
+        for col in ('Sex', 'Race', 'Ethnicity'):
+            vals = worker_rows[col].dropna().unique()
+            if len(vals) == 1:
+                results.loc[worker_rows.index, col] = vals.item()
+
+    results.drop_duplicates(dedup_cols, inplace=True)
+    results.fillna('Unknown or Not Reported', inplace=True)
+    return results
+
+
+def random_assignments(rng: np.random.Generator, workers: int) -> pd.DataFrame:
+    """
+    Assignments of `workers` workers with one to four rows each, after the
+    first duplicate removal pass. Answers are drawn from a few values per
+    column, so many workers give conflicting or missing ones.
+    """
+    answers = {'Sex': ['Male', 'Female', 'Unknown or Not Reported', np.nan],
+               'Race': ['White', 'Asian', 'More Than One Race', 'Unknown or Not Reported', 'Unknown', np.nan],
+               'Ethnicity': ['NonHisp', 'Hisp', 'Unknown or Not Reported', np.nan],
+               'Year': list(datebreaks) + ['Date out of range']}
+    workerids = np.repeat([f'A{i:05X}' for i in range(workers)], rng.integers(1, 5, workers))
+    results = pd.DataFrame({'workerid': workerids})
+    for col, values in answers.items():
+        # Most workers keep giving their first answer
+        first = pd.Series(rng.choice(np.array(values, dtype=object), len(results)))
+        first = first.groupby(workerids).transform('first')
+        other = rng.choice(np.array(values, dtype=object), len(results))
+        results[col] = np.where(rng.random(len(results)) < 0.7, first, other)
+    results = results.loc[:, core_cols].sort_values(['workerid', 'Year'])
+    return results.drop_duplicates(dedup_cols)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('seed', range(3))
+def test_remove_mismatched_duplicates_matches_loop(seed, compact):
+    """The groupby version keeps the same rows with the same values as the per-worker loop."""
+    results = random_assignments(np.random.default_rng(seed), 300)
+    expected = loop_remove_mismatched_duplicates(results)
+    if compact:
+        results = compact_results(results, compile_datebreaks(datebreaks))
+    deduped = remove_mismatched_duplicates(results)
+    assert list(deduped.index) == list(expected.index)
+    assert deduped.astype(str).equals(expected.astype(str))
+
+
+def test_conflicting_worker_keeps_one_row_per_answer():
+    """A worker who gave two different races keeps both rows, with their lowest year."""
+    results = pd.DataFrame({'workerid': ['A1', 'A1', 'A1', 'A2', 'A2'],
+                            'Sex': ['Male', np.nan, 'Male', 'Female', 'Unknown or Not Reported'],
+                            'Race': ['White', 'Asian', 'Unknown', 'Asian', 'Asian'],
+                            'Ethnicity': ['NonHisp', 'NonHisp', np.nan, 'Hisp', 'Hisp'],
+                            'Year': ['2017-2018', '2016-2017', '2018-2019', '2018-2019', '2017-2018']})
+    deduped = remove_mismatched_duplicates(results)
+    assert deduped.values.tolist() == [['A1', 'Male', 'White', 'NonHisp', '2016-2017'],
+                                       ['A1', 'Male', 'Asian', 'NonHisp', '2016-2017'],
+                                       ['A1', 'Male', 'Unknown or Not Reported', 'NonHisp', '2016-2017'],
+                                       ['A2', 'Female', 'Asian', 'Hisp', '2017-2018']]
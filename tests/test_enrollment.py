@@ -0,0 +1,24 @@
+"""
+Tests of mturkrsrb.enrollment.
+"""
+
+import pandas as pd
+
+from mturkrsrb.enrollment import enrollment_tables, overall
+
+
+def test_rows_outside_categories_are_reported(capsys):
+    """Rows with a sex, race or ethnicity the tables don't list are left out with a warning."""
+    results = pd.DataFrame({'workerid': ['A1', 'A2', 'A3', 'A4'],
+                            'Sex': ['Female', "['Other']", 'Male', 'Male'],
+                            'Race': ['Asian', 'White', 'White', 'White'],
+                            'Ethnicity': ['Hisp', 'NonHisp', 'Refused', 'NonHisp'],
+                            'Year': ['2017-2018', '2017-2018', '2018-2019', 'Date out of range']},
+                           index=[10, 11, 12, 13])
+    tables = enrollment_tables(results, ['2017-2018', '2018-2019'])
+    assert tables[overall].loc['Total', ('Total', '')] == 2
+    assert tables['2017-2018'].loc['Asian', ('Hisp', 'Female')] == 1
+    assert tables['2018-2019'].loc['Total', ('Total', '')] == 0
+    out = capsys.readouterr().out
+    assert 'Warning: 2 report rows' in out
+    assert "Ethnicity 'Refused' (1)" in out and "Sex \"['Other']\" (1)" in out
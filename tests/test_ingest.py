@@ -0,0 +1,32 @@
+"""
+Tests of mturkrsrb.ingest.
+"""
+
+import numpy as np
+import pandas as pd
+
+from mturkrsrb.ingest import concat_results, normalize_columns
+
+
+def test_normalize_columns_makes_categoricals():
+    """Worker IDs, answers and config defaults are categoricals right after reading."""
+    rdf = pd.DataFrame({'WorkerId': ['A2', 'A1', 'A2'], 'Answer.rsrb.sex': ["['Male']", np.nan, "['Female']"],
+                        'Answer.rsrb.age': ['30', '41', '22']})
+    results = normalize_columns(rdf, {'file': 'results.tsv', 'name': 'Exp', 'experimenter': 'Someone'})
+    for col in ('workerid', 'Sex', 'Experiment', 'Experimenter'):
+        assert isinstance(results[col].dtype, pd.CategoricalDtype)
+    assert results['workerid'].cat.categories.tolist() == ['A1', 'A2']
+    assert results['Age'].tolist() == ['30', '41', '22']
+
+
+def test_concat_results_keeps_categoricals():
+    """Frames with different categories, text columns or missing columns concatenate to one categorical."""
+    first = pd.DataFrame({'workerid': pd.Categorical(['A3', 'A1']), 'flag': [True, False]})
+    second = pd.DataFrame({'workerid': ['A2', np.nan], 'other': ['x', 'y']})
+    third = pd.DataFrame({'other': ['z']})
+    results = concat_results([first, second, third])
+    assert results.columns.tolist() == ['workerid', 'flag', 'other']
+    assert results['workerid'].cat.categories.tolist() == ['A1', 'A3', 'A2']
+    assert results['workerid'].tolist()[:3] == ['A3', 'A1', 'A2']
+    assert results['workerid'][3:].isna().all()
+    assert results['flag'].tolist()[:2] == [True, False]
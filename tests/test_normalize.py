@@ -0,0 +1,117 @@
+"""
+Tests of mturkrsrb.normalize.
+"""
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from mturkrsrb.dedup import core_cols
+from mturkrsrb.normalize import normalize_race, normalize_results, parse_timestamps, race_codes, race_flags
+from mturkrsrb.years import assign_years, compile_datebreaks
+
+datebreaks = {'2017-2018': {'start': '2017-06-01', 'end': '2018-05-31'}}
+
+
+def rowwise_normalize_race(row: pd.core.series.Series) -> str:
+    """
+    The row-at-a-time `normalize_race` this package started with, kept as
+    the reference for the vectorized one. It only handles the three survey
+    layouts (a single code, codes separated by '|' and 'unknown;' with a
+    column per race).
+    """
+    try:
+        if row['Answer.rsrb.race'] in ('amerind;', 'asian;', 'black;', 'other;',
+                                       'pacif;', 'white;'):
+            return {'amerind;': 'American Indian / Alaska Native',
+                    'asian;': 'Asian',
+                    'black;': 'Black or African American',
+                    'other;': 'Other',
+                    'pacif;': 'Native Hawaiian or Other Pacific Islander',
+                    'white;': 'White'}[row['Answer.rsrb.race']]
+        elif row['Answer.rsrb.race'].find('|') >= 0:
+            return 'More Than One Race'
+        elif row['Answer.rsrb.race'] == 'unknown;':
+            racecols = \
+                (row['Answer.rsrb.race.amerind'],
+                 row['Answer.rsrb.race.asian'],
+                 row['Answer.rsrb.race.black'],
+                 row['Answer.rsrb.race.other'],
+                 row['Answer.rsrb.race.pacif'],
+                 row['Answer.rsrb.race.unknown'],
+                 row['Answer.rsrb.race.white'])
+        numraces = len([x for x in racecols if x])
+        if numraces > 1:
+            return 'More Than One Race'
+        elif numraces == 0:
+            return 'Unknown or Not Reported'
+        else:
+            return {
+                0: 'American Indian / Alaska Native',
+                1: 'Asian',
+                2: 'Black or African American',
+                3: 'Other',
+                4: 'Native Hawaiian or Other Pacific Islander',
+                5: 'Unknown or Not Reported',
+                6: 'White'}[racecols.index(True)]
+    except AttributeError as e:
+        print(e)
+        print(row)
+
+
+def random_race_answers(rng: np.random.Generator, layout: str, rows: int) -> pd.DataFrame:
+    """
+    Random race answers in one survey layout ('single', 'multi' or
+    'columns', or 'mixed' for all three), with the race columns filled in
+    the way `normalize_results` leaves them.
+    """
+    codes = np.array(list(race_codes), dtype=object)
+    answers = {'single': rng.choice(codes, rows),
+               'multi': ['|'.join(rng.choice(codes, rng.integers(2, 4), replace=False)) for _ in range(rows)],
+               'columns': np.full(rows, 'unknown;', dtype=object)}
+    if layout == 'mixed':
+        race = np.choose(rng.integers(0, 3, rows), [np.asarray(a, dtype=object) for a in answers.values()])
+    else:
+        race = answers[layout]
+    results = pd.DataFrame({'Answer.rsrb.race': race})
+    for key in race_flags:
+        # Mostly one race or none, sometimes several
+        results[f'Answer.rsrb.race.{key}'] = rng.random(rows) < (0.2 if layout != 'single' else 0.0)
+    return results
+
+
+def test_normalize_without_demographics():
+    """A results file with no Answer.rsrb.* columns gives all-unknown demographics."""
+    results = pd.DataFrame({'workerid': ['A1', 'A2'],
+                            'assignmentsubmittime': ['2018-01-03T18:22:11Z', np.nan]})
+    results = assign_years(normalize_results(results), compile_datebreaks(datebreaks))
+    assert set(core_cols) <= set(results.columns)
+    assert results['Sex'].isna().all()
+    assert results['Ethnicity'].isna().all()
+    assert (results['Race'] == 'Unknown or Not Reported').all()
+    assert list(results['Year'].astype(str)) == ['2017-2018', 'Date out of range']
+
+
+def test_normalize_one_chunk_without_demographics():
+    """Normalizing the placeholder row `pipeline.normalized_columns` makes works too."""
+    row = pd.DataFrame(np.nan, index=[0], columns=['workerid', 'assignmentsubmittime'], dtype=object)
+    results = normalize_results(row)
+    assert results['Sex'].isna().all()
+
+
+def test_parse_mixed_iso_flavors():
+    """Every ISO 8601 flavor in a column is parsed, not just the first one's."""
+    timestamps = pd.Series(['2018-01-03T18:22:11Z', '2018-01-03T18:22:11.000Z',
+                            '2018-01-03 10:22:11-08:00', '2018-01-03T18:22'])
+    parsed = parse_timestamps(timestamps)
+    assert (parsed[:3] == pd.Timestamp('2018-01-03T18:22:11Z')).all()
+    assert parsed[3] == pd.Timestamp('2018-01-03T18:22Z')
+
+
+@pytest.mark.parametrize('layout', ['single', 'multi', 'columns', 'mixed'])
+@pytest.mark.parametrize('seed', range(5))
+def test_normalize_race_matches_rowwise(layout, seed):
+    """The vectorized `normalize_race` gives the same race for every row as the row-wise one."""
+    results = random_race_answers(np.random.default_rng(seed), layout, 500)
+    expected = results.apply(rowwise_normalize_race, axis=1)
+    assert normalize_race(results).tolist() == expected.tolist()
@@ -0,0 +1,60 @@
+"""
+Tests of mturkrsrb.pipeline.
+"""
+
+import glob
+import os
+
+import pandas as pd
+
+from benchmarks.synthetic import generate_corpus
+from mturkrsrb.config import load_config
+from mturkrsrb.pipeline import build_report, build_reports
+from mturkrsrb.years import compile_datebreaks
+
+
+def read_rawsubjects(directory: str, protocol: str = '*') -> pd.DataFrame:
+    """Read the --rawsubjects file of `protocol` written to `directory`."""
+    filename, = glob.glob(os.path.join(directory, f'{protocol}_rawsubjects-*.csv'))
+    return pd.read_csv(filename, low_memory=False)
+
+
+def test_stream_matches_in_memory(tmp_path, monkeypatch):
+    """Streaming in small chunks makes the same report and raw subjects as reading everything at once."""
+    expdata = load_config(generate_corpus(str(tmp_path / 'corpus'), 2000, seed=1))
+    yearbreaks = compile_datebreaks(expdata['datebreaks'])
+
+    reports = {}
+    for run, stream in (('batch', False), ('stream', True)):
+        (tmp_path / run).mkdir()
+        monkeypatch.chdir(tmp_path / run)
+        # The row labels are not written out, only the rows and their order
+        reports[run] = build_report(expdata, yearbreaks, stream=stream, chunksize=97,
+                                    rawsubjects=True).reset_index(drop=True)
+
+    pd.testing.assert_frame_equal(reports['stream'], reports['batch'])
+    pd.testing.assert_frame_equal(read_rawsubjects(tmp_path / 'stream'), read_rawsubjects(tmp_path / 'batch'))
+
+
+def test_build_reports_matches_single_runs(tmp_path, monkeypatch):
+    """Each protocol of a multi-config run gets the report and raw subjects of a run on its config alone."""
+    corpus = load_config(generate_corpus(str(tmp_path / 'corpus'), 2000, seed=2))
+    # Both configs list results2-3, each with its own name and experimenter
+    expdatas = [dict(corpus, protocol='protoA', resultsfiles=corpus['resultsfiles'][:4]),
+                dict(corpus, protocol='protoB', resultsfiles=[
+                    dict(r, name=f'Other {r["name"]}', experimenter='Other Lab')
+                    for r in corpus['resultsfiles'][2:]])]
+    yearbreaks = [compile_datebreaks(expdata['datebreaks']) for expdata in expdatas]
+
+    (tmp_path / 'batch').mkdir()
+    monkeypatch.chdir(tmp_path / 'batch')
+    reports = build_reports(expdatas, yearbreaks, rawsubjects=True)
+
+    for expdata, protocol_yearbreaks, report in zip(expdatas, yearbreaks, reports):
+        single = tmp_path / expdata['protocol']
+        single.mkdir()
+        monkeypatch.chdir(single)
+        alone = build_report(expdata, protocol_yearbreaks, rawsubjects=True)
+        pd.testing.assert_frame_equal(report.reset_index(drop=True), alone.reset_index(drop=True))
+        pd.testing.assert_frame_equal(read_rawsubjects(tmp_path / 'batch', expdata['protocol']),
+                                      read_rawsubjects(single, expdata['protocol']))
@@ -0,0 +1,117 @@
+"""
+Tests of mturkrsrb.redcap.
+"""
+
+import pandas as pd
+import pytest
+
+from mturkrsrb.redcap import (delta_records, export_redcap, next_record_index, out_columns, read_ledger,
+                              redcap_records, update_ledger)
+
+
+def make_report(rows) -> pd.DataFrame:
+    """Make report rows out of (workerid, Sex, Race, Ethnicity) tuples."""
+    return pd.DataFrame(rows, columns=['workerid', 'Sex', 'Race', 'Ethnicity'])
+
+
+# The ledger of an earlier export: A and B with a record each
+earlier = make_report([('A1', 'Female', 'White', 'NonHisp'),
+                       ('B2', 'Male', 'Asian', 'Hisp')])
+
+
+def test_redcap_records_codes_every_row():
+    """Every row of a report, categorical as the pipeline makes it, gets a record ID and codes."""
+    report = make_report([('A1', 'Female', 'White', 'NonHisp'),
+                          ('B2', 'Unknown or Not Reported', 'Other', 'Unknown or Not Reported'),
+                          ('C3', 'Male', 'More Than One Race', 'Hisp')]).astype('category')
+    records = redcap_records(report, 10)
+    assert list(records.columns) == list(out_columns)
+    assert list(records['record_id']) == ['mt0010', 'mt0011', 'mt0012']
+    assert records.drop(columns='mturk_age').notna().all().all()
+    assert list(records['mturk_sex']) == [0, 2, 1]
+    assert list(records['mturk_race']) == [4, 6, 5]
+    assert list(records['mturk_ethnicity']) == [1, 2, 0]
+
+
+def test_redcap_records_unmapped_values():
+    """Labels with no REDCap code raise a single ValueError listing all of them."""
+    report = make_report([('A1', 'Female', 'Martian', 'NonHisp'),
+                          ('B2', "['Other']", 'White', None),
+                          ('C3', "['Other']", 'White', 'Hisp')])
+    with pytest.raises(ValueError) as excinfo:
+        redcap_records(report)
+    message = str(excinfo.value)
+    assert "Sex: \"['Other']\" (2)" in message
+    assert "Race: 'Martian' (1)" in message
+    assert "Ethnicity: '<empty>' (1)" in message
+
+
+def test_delta_records_keeps_new_and_changed():
+    """Only new workers are exported, and known workers whose demographics changed only when updating."""
+    ledger = redcap_records(earlier)
+    records = redcap_records(make_report([('A1', 'Female', 'White', 'NonHisp'),
+                                          ('B2', 'Female', 'Asian', 'Hisp'),
+                                          ('C3', 'Male', 'White', 'NonHisp')]))
+
+    new, updated = delta_records(records, ledger)
+    assert list(new['mturk_workerid']) == ['C3']
+    assert list(new['record_id']) == ['mt0002']
+    assert updated.empty
+
+    new, updated = delta_records(records, ledger, updates=True)
+    assert list(new['mturk_workerid']) == ['C3']
+    assert list(new['record_id']) == ['mt0002']
+    assert list(updated['record_id']) == ['mt0001']
+    assert list(updated['mturk_sex']) == [0]
+
+
+def test_delta_records_worker_listed_twice():
+    """A worker with more than one record in the ledger is never updated, only added to."""
+    ledger = redcap_records(make_report([('A1', 'Female', 'White', 'NonHisp'),
+                                         ('A1', 'Male', 'White', 'NonHisp')]))
+    records = redcap_records(make_report([('A1', 'Unknown or Not Reported', 'White', 'NonHisp')]))
+
+    new, updated = delta_records(records, ledger, updates=True)
+    assert list(new['record_id']) == ['mt0002']
+    assert updated.empty
+
+    records = redcap_records(make_report([('A1', 'Male', 'White', 'NonHisp')]))
+    new, updated = delta_records(records, ledger, updates=True)
+    assert new.empty and updated.empty
+
+
+def test_record_ids_continue_after_ledger():
+    """New record IDs follow the highest 'mtNNNN' ID in the ledger, skipping other IDs."""
+    ledger = redcap_records(earlier, 7).assign(record_id=['mt0007', 'legacy99'])
+    assert next_record_index(ledger) == 8
+    assert next_record_index(ledger.iloc[:0]) == 0
+
+    new, _ = delta_records(redcap_records(make_report([('C3', 'Male', 'White', 'NonHisp')])), ledger)
+    assert list(new['record_id']) == ['mt0008']
+
+
+def test_startindex_overrides_ledger(tmp_path, monkeypatch):
+    """A start index past the ledger's IDs is used; one inside them is not."""
+    monkeypatch.chdir(tmp_path)
+    redcap_records(earlier).to_csv('ledger.csv', index=False)
+    report = make_report([('C3', 'Male', 'White', 'NonHisp')])
+
+    for startindex, record_id in ((50, 'mt0050'), (1, 'mt0002')):
+        outfile, new, updated = export_redcap(report, 'proto', startindex, previous=['ledger.csv'])
+        assert (new, updated) == (1, 0)
+        assert list(pd.read_csv(outfile)['record_id']) == [record_id]
+
+
+def test_update_ledger_replaces_updated_records(tmp_path):
+    """Updated records replace the ledger's record with the same ID, new ones are added."""
+    filename = str(tmp_path / 'ledger.csv')
+    ledger = redcap_records(earlier)
+    records = redcap_records(make_report([('B2', 'Female', 'Asian', 'Hisp'),
+                                          ('C3', 'Male', 'White', 'NonHisp')]))
+    new, updated = delta_records(records, ledger, updates=True)
+    update_ledger(filename, ledger, new, updated)
+
+    written = read_ledger([filename])
+    assert list(written['record_id']) == ['mt0000', 'mt0001', 'mt0002']
+    assert list(written['mturk_workerid']) == ['A1', 'B2', 'C3']
+    assert list(written['mturk_sex']) == [0, 0, 1]
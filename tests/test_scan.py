@@ -0,0 +1,37 @@
+"""
+Tests of mturkrsrb.scan.
+"""
+
+from mturkrsrb import scan
+
+
+def write_resultsfile(filename, rows, field_size: int, long_row: int = -1):
+    """Write a tab delimited results file with `rows` rows of about `field_size` bytes each."""
+    with open(filename, 'w') as resfile:
+        resfile.write('workerid\tAnswer.comments\n')
+        for i in range(rows):
+            extra = '\tstray' if i == long_row else ''
+            resfile.write(f'W{i:05d}\t{"x" * field_size}{extra}\n')
+
+
+def test_rows_larger_than_first_read(tmp_path, monkeypatch):
+    """Rows longer than the first read are still counted and have their fields checked."""
+    monkeypatch.setattr(scan, 'scan_bytes', 1024)
+    filename = tmp_path / 'results.tsv'
+    write_resultsfile(filename, 1000, 2000, long_row=50)
+
+    entry = scan.scan_resultsfile({'file': str(filename)})
+    assert not entry['exact_rows']
+    assert 950 <= entry['rows'] <= 1050
+    error, = entry['errors']
+    assert error.startswith('1 of the first ') and error.endswith(' rows have more fields than the header')
+    assert int(error.split()[4]) >= scan.scan_records
+
+
+def test_small_file_is_read_whole(tmp_path):
+    """A file shorter than the first read has its rows counted exactly."""
+    filename = tmp_path / 'results.tsv'
+    write_resultsfile(filename, 10, 20)
+
+    entry = scan.scan_resultsfile({'file': str(filename)})
+    assert (entry['rows'], entry['exact_rows'], entry['errors']) == (10, True, [])
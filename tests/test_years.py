@@ -0,0 +1,34 @@
+"""
+Tests of mturkrsrb.years.
+"""
+
+import pandas as pd
+
+from mturkrsrb.normalize import parse_timestamps
+from mturkrsrb.years import add_logical_year, compile_datebreaks
+
+datebreaks = {'2017-2018': {'start': '2017-06-01', 'end': '2018-05-31'},
+              '2018-2019': {'start': '2018-06-01', 'end': '2019-05-31'}}
+
+
+def test_evening_of_last_day_stays_in_year():
+    """
+    A submission after 17:00 PDT on May 31 is June 1 in UTC but still in the
+    earlier year, whether it is written as a web UI time, an API (UTC) time,
+    with another offset or without a time zone (taken as UTC).
+    """
+    submittimes = parse_timestamps(pd.Series(['Thu May 31 18:12:59 PDT 2018',
+                                              'Fri Jun 01 00:00:01 PDT 2018',
+                                              '2018-06-01T06:59:59Z',
+                                              '2018-06-01T07:00:00Z',
+                                              '2018-06-01T02:59:59-04:00',
+                                              '2018-06-01 06:59:59']))
+    years = add_logical_year(submittimes, compile_datebreaks(datebreaks))
+    assert list(years) == ['2017-2018', '2018-2019', '2017-2018', '2018-2019', '2017-2018', '2017-2018']
+
+
+def test_dates_outside_ranges():
+    """Dates before the first range or that can't be parsed get no report year."""
+    submittimes = parse_timestamps(pd.Series(['Wed May 31 23:59:59 PDT 2017', 'not a date']))
+    years = add_logical_year(submittimes, compile_datebreaks(datebreaks))
+    assert list(years) == ['Date out of range', 'Date unparseable']